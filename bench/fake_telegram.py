@@ -0,0 +1,100 @@
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import Counter
+from typing import Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+# Методы, которые возвращают Message
+MESSAGE_METHODS = {
+    "sendmessage", "sendphoto", "senddocument",
+    "editmessagetext", "editmessagemedia", "editmessagecaption", "editmessagereplymarkup",
+}
+
+
+class FakeTelegram:
+    """Заглушка Bot API на aiohttp: отвечает правдоподобными объектами и считает вызовы.
+
+    latency — искусственная задержка ответа, секунды; flood_every — каждый
+    N-й запрос получает 429 с retry_after (0 — без флуд-ошибок).
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, flood_every: int = 0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.flood_every = flood_every
+        self.calls: Counter = Counter()
+        self.floods = 0
+        self._ids = itertools.count(1000)
+        self._requests = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self.app = web.Application(client_max_size=64 * 1024 * 1024)
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def _message(self, method: str, params: dict) -> dict:
+        chat_id = int(params.get("chat_id") or 0)
+        message = {
+            "message_id": int(params.get("message_id") or next(self._ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if method == "sendphoto" or method == "editmessagemedia":
+            file_id = f"photo-{next(self._ids)}"
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 720}]
+            message["caption"] = params.get("caption", "")
+        elif method == "senddocument":
+            file_id = f"doc-{next(self._ids)}"
+            message["document"] = {"file_id": file_id, "file_unique_id": file_id}
+        else:
+            message["text"] = params.get("text", "")
+        return message
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        self.calls[method] += 1
+        params = dict(await request.post())
+        if "media" in params and isinstance(params["media"], str):
+            media = json.loads(params["media"])
+            params.setdefault("caption", media.get("caption", ""))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_every and next(self._requests) % self.flood_every == 0:
+            self.floods += 1
+            return web.json_response(
+                {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                 "parameters": {"retry_after": 1}},
+                status=429,
+            )
+
+        if method in MESSAGE_METHODS:
+            result = self._message(method, params)
+        elif method == "getme":
+            result = BOT_USER
+        else:
+            # answerCallbackQuery, setWebhook, deleteWebhook, answerInlineQuery и т.п.
+            result = True
+        return web.json_response({"ok": True, "result": result})
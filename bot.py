@@ -1,6 +1,8 @@
 import asyncio
 import os
 import logging
+import tempfile
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, F
 from aiogram.types import (
@@ -9,11 +11,36 @@ from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     InputMediaPhoto,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    ChatMemberUpdated,
     FSInputFile,
 )
 from aiogram.exceptions import TelegramBadRequest
-from aiogram.filters import Command
-from database import Database
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from database import CapacityExceeded, Database
+from media import MediaRegistry
+from catalog import Catalog
+from users import UserRegistry
+from webhook import run_webhook
+from state import StateStoreStorage, build_state_store
+from callbacks import CategoryCB, OrdersCB, ProductCB, QtyCB, ReorderCB
+from notifier import NotificationDispatcher
+from broadcast import BroadcastRunner, format_progress
+from debounce import QuantityDebouncer
+from render import classify_edit_error, is_current, render_key
+from keyboards import CART_BUTTON, KeyboardTemplates
+from search import SEARCH_RESULTS_LIMIT, SearchIndex, tokenize
+from carts import build_cart_engine
+from concurrency import UserSerializer
+from outbound import OutboundScheduler
+import metrics
+import reports
 
 load_dotenv()
 
@@ -24,11 +51,39 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не найден в переменных окружения")
 
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+# Свой адрес Bot API (локальный сервер или заглушка для тестов)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").strip()
+
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=BOT_TOKEN, session=session)
+# Все исходящие запросы идут через лимиты и очередь с приоритетами
+outbound = OutboundScheduler()
+bot.session.middleware(outbound)
 db = Database()
+state_store = build_state_store(db)
+dp = Dispatcher(storage=StateStoreStorage(state_store))
+media = MediaRegistry(db)
+catalog = Catalog(db)
+users = UserRegistry(db)
+carts = build_cart_engine(db, catalog)
+notifier = NotificationDispatcher(db, bot)
+broadcasts = BroadcastRunner(db, bot, outbound.limiter)
+# Обновления одного пользователя — строго по очереди (двойное нажатие «Оформить заказ» и т.п.)
+dp.update.outer_middleware(UserSerializer())
+dp.message.middleware(metrics.handler_metrics_middleware)
+dp.callback_query.middleware(metrics.handler_metrics_middleware)
+dp.inline_query.middleware(metrics.handler_metrics_middleware)
 ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip().isdigit()]
-PENDING_PHONE = set()
+IMAGE_PATH = "image.png"
+metrics_runner = None
+PRODUCTS_PAGE_SIZE = int(os.getenv("PRODUCTS_PAGE_SIZE", "10"))
+keyboards = KeyboardTemplates(catalog, PRODUCTS_PAGE_SIZE)
+search_index = SearchIndex(catalog)
+# Сколько секунд Telegram может кешировать ответ на inline-запрос (он одинаков для всех)
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "60"))
+ORDERS_PAGE_SIZE = int(os.getenv("ORDERS_PAGE_SIZE", "5"))
 
 # Константы
 WELCOME_TEXT = """Мы готовим с любовью! Ждём ваши заказы.
@@ -41,91 +96,121 @@ ABOUT_TEXT = WELCOME_TEXT
 ABOUT_TEXT += "\n\nЕм&ем\nГородская ул., 20, Троицк\nhttps://yandex.ru/maps/org/yemem/42994344316?si=8qbne2jmc0nkgmphyryxvbnpq4"
 
 
+class CheckoutStates(StatesGroup):
+    waiting_phone = State()
+
+
 def get_main_menu_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Меню", callback_data="menu")],
+        [InlineKeyboardButton(text="📦 Мои заказы", callback_data=OrdersCB().pack())],
         [InlineKeyboardButton(text="О нас", callback_data="about")]
     ])
 
 
-async def ensure_user(callback: CallbackQuery):
+async def ensure_user(callback):
     """Гарантирует наличие пользователя в таблице users."""
     user = callback.from_user
-    await db.get_or_create_user(user.id, user.username, user.first_name)
+    await users.ensure(user.id, user.username, user.first_name)
 
 
 async def send_photo_message(message_obj, caption: str, reply_markup=None):
-    photo = FSInputFile("image.png")
-    return await message_obj.answer_photo(photo=photo, caption=caption, reply_markup=reply_markup)
+    return await media.send(
+        IMAGE_PATH,
+        lambda photo: message_obj.answer_photo(photo=photo, caption=caption, reply_markup=reply_markup)
+    )
+
+
+def is_editable(message_obj) -> bool:
+    """Править можно только сообщения бота; сообщение пользователя сразу заменяем новым."""
+    return message_obj.from_user is None or message_obj.from_user.is_bot
+
+
+async def _edit_or_send(message_obj, render: str, edit, send):
+    """Общая логика правки: пропуск одинаковых отрисовок и новое сообщение, только если править нельзя."""
+    if is_current(message_obj, render):
+        return message_obj
+    if is_editable(message_obj):
+        try:
+            return await edit()
+        except TelegramBadRequest as e:
+            reason = classify_edit_error(e)
+            if reason == "not_modified":
+                return message_obj
+            if reason != "uneditable":
+                raise
+            logger.debug(f"Сообщение нельзя отредактировать ({e}), отправляем новое")
+    return await send()
 
 
 async def edit_to_photo(message_obj, caption: str, reply_markup=None):
-    photo = FSInputFile("image.png")
-    media = InputMediaPhoto(media=photo, caption=caption)
-    try:
-        return await message_obj.edit_media(media=media, reply_markup=reply_markup)
-    except Exception as e:
-        logger.debug(f"edit_media failed ({e}), sending new photo message")
-        return await send_photo_message(message_obj, caption, reply_markup)
+    return await _edit_or_send(
+        message_obj,
+        render_key("photo", caption, reply_markup),
+        lambda: media.send(
+            IMAGE_PATH,
+            lambda photo: message_obj.edit_media(
+                media=InputMediaPhoto(media=photo, caption=caption),
+                reply_markup=reply_markup
+            )
+        ),
+        lambda: send_photo_message(message_obj, caption, reply_markup)
+    )
 
 
 async def safe_edit_text(message_obj, text: str, reply_markup=None):
-    """Пробует edit_text, если нельзя (например, у сообщения фото) — отправляет новое."""
-    try:
-        return await message_obj.edit_text(text, reply_markup=reply_markup)
-    except TelegramBadRequest as e:
-        logger.debug(f"edit_text failed ({e}), sending new text message")
-        return await message_obj.answer(text, reply_markup=reply_markup)
+    """Правит сообщение, если отрисовка изменилась; если править нельзя (например, у сообщения фото) — отправляет новое."""
+    render = render_key("text", text, reply_markup)
+
+    return await _edit_or_send(
+        message_obj,
+        render,
+        lambda: message_obj.edit_text(text, reply_markup=reply_markup),
+        lambda: message_obj.answer(text, reply_markup=reply_markup)
+    )
+
+
+def get_category_name(category_id: int) -> str:
+    category = catalog.category(category_id)
+    return category['name'] if category else "Категория"
 
 
 def get_categories_keyboard(user_id: int = None):
     async def _get():
-        categories = await db.get_categories()
-        keyboard = []
-        for cat in categories:
-            keyboard.append([InlineKeyboardButton(
-                text=cat['name'],
-                callback_data=f"category_{cat['id']}"
-            )])
-        keyboard.append([InlineKeyboardButton(text="◀️ Назад", callback_data="main_menu")])
-        return InlineKeyboardMarkup(inline_keyboard=keyboard)
+        return keyboards.categories()
     return _get
 
 
-async def get_products_keyboard(category_id: int, user_id: int):
-    products = await db.get_products_by_category(category_id)
-    cart_items = await db.get_cart_items(user_id)
-    cart_map = {item["product_id"]: item["quantity"] for item in cart_items}
-    keyboard = []
-    
-    for product in products:
-        qty = cart_map.get(product["id"], 0)
-        checkmark = "✅ " if qty > 0 else ""
-        name = product['name']
-        if len(name) > 25:
-            name = name[:22] + "..."
-        suffix = f" x{qty}" if qty > 0 else ""
-        button_text = f"{checkmark}{name}{suffix} - {product['price']}₽"
-        keyboard.append([InlineKeyboardButton(
-            text=button_text,
-            callback_data=f"product_{product['id']}"
-        )])
-    
-    keyboard.append([InlineKeyboardButton(text="🛒 В корзину", callback_data="show_cart")])
-    keyboard.append([InlineKeyboardButton(text="◀️ Назад к категориям", callback_data="menu")])
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+def get_page_count(category_id: int) -> int:
+    return keyboards.page_count(category_id)
 
 
-async def get_product_keyboard(product_id: int, user_id: int = None):
-    qty = await db.get_cart_quantity(user_id, product_id) if user_id else 0
+async def get_products_keyboard(category_id: int, user_id: int, page: int = 0):
+    cart_map = await carts.get_cart_quantities(user_id)
+    return keyboards.products(category_id, page, cart_map)
+
+
+async def get_product_keyboard(product: dict, qty: int = 0, page: int = 0):
+    product_id = product['id']
+    category_id = product['category_id']
+    version = catalog.version
     return InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="➖", callback_data=f"dec_{product_id}"),
+            InlineKeyboardButton(
+                text="➖",
+                callback_data=QtyCB(id=product_id, d=-1, c=category_id, q=qty, page=page, v=version).pack()
+            ),
             InlineKeyboardButton(text=f"{qty} шт.", callback_data="noop"),
-            InlineKeyboardButton(text="➕", callback_data=f"inc_{product_id}")
+            InlineKeyboardButton(
+                text="➕",
+                callback_data=QtyCB(id=product_id, d=1, c=category_id, q=qty, page=page, v=version).pack()
+            )
         ],
-        [InlineKeyboardButton(text="🛒 В корзину", callback_data="show_cart")],
-        [InlineKeyboardButton(text="◀️ Назад", callback_data=f"back_to_category")]
+        [CART_BUTTON],
+        [InlineKeyboardButton(
+            text="◀️ Назад",
+            callback_data=CategoryCB(id=category_id, page=page, v=version).pack()
+        )]
     ])
 
 
@@ -137,17 +222,45 @@ async def get_cart_keyboard():
 
 
 async def finalize_order(user_id: int, send_func, reply_markup=None, tg_user=None):
-    """Создаёт заказ, отправляет подтверждение и нотификации админам."""
-    cart_items = await db.get_cart_items(user_id)
-    if not cart_items:
+    """Создаёт заказ, отправляет подтверждение и ставит в очередь нотификации админам."""
+    username = getattr(tg_user, "username", None) if tg_user else None
+    full_name = getattr(tg_user, "full_name", None) if tg_user else None
+
+    def admin_text(order):
+        user_line = f"Пользователь: {full_name or user_id}"
+        if username:
+            user_line += f" (@{username})"
+        user_line += f"\nТелефон: {order['phone'] or 'не указан'}"
+        return (
+            f"Новый заказ #{order['order_id']}\n"
+            f"{user_line}\n\n"
+            f"{format_cart_text(order['items'], order['total'])}"
+        )
+
+    # Заказ собирается из cart_items, поэтому несохранённые изменения корзины пишем сразу
+    await carts.flush(user_id)
+    # Уведомления администраторам пишутся в той же транзакции, что и заказ
+    try:
+        order = await db.create_order(user_id, ADMIN_IDS, admin_text)
+    except CapacityExceeded as e:
+        await send_func(format_capacity_error(e), reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [CART_BUTTON],
+            [InlineKeyboardButton(text="◀️ В главное меню", callback_data="main_menu")]
+        ]))
+        return
+    finally:
+        carts.invalidate(user_id)
+    if not order:
         await send_func("Ваша корзина пуста", reply_markup=reply_markup)
         return
 
-    total = await db.get_cart_total(user_id)
-    order_id = await db.create_order(user_id)
-    phone = await db.get_user_phone(user_id)
-    username = getattr(tg_user, "username", None) if tg_user else None
-    full_name = getattr(tg_user, "full_name", None) if tg_user else None
+    order_id = order["order_id"]
+    cart_items = order["items"]
+    total = order["total"]
+    if ADMIN_IDS:
+        notifier.wake()
+    else:
+        logger.info("ADMIN_IDS не заданы, уведомления админам не отправлены")
 
     text = "✅ Заказ оформлен!\n\n"
     text += f"Номер заказа: #{order_id}\n\n"
@@ -164,26 +277,23 @@ async def finalize_order(user_id: int, send_func, reply_markup=None, tg_user=Non
 
     await send_func(text, reply_markup=reply_markup)
 
-    # Уведомление администраторов
-    if ADMIN_IDS:
-        user_line = f"Пользователь: {full_name or user_id}"
-        if username:
-            user_line += f" (@{username})"
-        user_line += f"\nТелефон: {phone or 'не указан'}"
 
-        admin_text = (
-            f"Новый заказ #{order_id}\n"
-            f"{user_line}\n\n"
-            f"{format_cart_text(cart_items, total)}"
-        )
-        for admin_id in ADMIN_IDS:
-            try:
-                logger.info(f"Отправка уведомления админу {admin_id} по заказу #{order_id}")
-                await bot.send_message(admin_id, admin_text)
-            except Exception as e:
-                logger.error(f"Не удалось отправить уведомление админу {admin_id}: {e}")
-    else:
-        logger.info("ADMIN_IDS не заданы, уведомления админам не отправлены")
+def format_capacity_error(error: CapacityExceeded) -> str:
+    if error.day_full:
+        return "😔 На сегодня кухня больше не принимает заказы. Корзина сохранена."
+    text = "😔 Не получилось оформить заказ — этого уже не хватает:\n\n"
+    for product in error.products:
+        left = f"осталось {product['remaining']} шт." if product["remaining"] else "закончилось"
+        text += f"• {product['name']} — {left}\n"
+    text += "\nИзмените количество в корзине и оформите заказ снова."
+    return text
+
+
+def format_remaining(product_id: int) -> str:
+    remaining = catalog.remaining(product_id)
+    if remaining is None:
+        return ""
+    return f"Осталось на сегодня: {remaining} шт.\n" if remaining else "Сегодня закончилось\n"
 
 
 def format_cart_text(cart_items, total):
@@ -196,11 +306,14 @@ def format_cart_text(cart_items, total):
     return text
 
 
-async def show_cart(callback: CallbackQuery):
+async def show_cart(callback: CallbackQuery, notify: str = None):
     user_id = callback.from_user.id
-    cart_items = await db.get_cart_items(user_id)
-    total = await db.get_cart_total(user_id)
+    await quantity_debouncer.flush(callback.message.chat.id)
+    cart_items = await carts.get_cart_items(user_id)
+    total = await carts.get_cart_total(user_id)
     text = format_cart_text(cart_items, total)
+    if cart_items and catalog.day_remaining == 0:
+        text += "\n\n⚠️ На сегодня заказы больше не принимаются."
     if cart_items:
         markup = await get_cart_keyboard()
     else:
@@ -209,32 +322,38 @@ async def show_cart(callback: CallbackQuery):
             [InlineKeyboardButton(text="◀️ В главное меню", callback_data="main_menu")]
         ])
     await safe_edit_text(callback.message, text, reply_markup=markup)
-    await callback.answer()
+    await callback.answer(notify)
 
 
-async def render_product_view(callback: CallbackQuery, product: dict, user_id: int, notify: str = None):
-    product_id = product["id"]
-    qty = await db.get_cart_quantity(user_id, product_id)
+async def render_product_message(message_obj, product: dict, qty: int, page: int = 0):
     checkmark = "✅ В корзине\n\n" if qty > 0 else ""
 
     text = f"{checkmark}🍽 {product['name']}\n"
     if product['weight']:
         text += f"К-во: {product['weight']}\n"
     text += f"Цена: {product['price']}₽\n"
+    text += format_remaining(product['id'])
     text += f"В корзине: {qty} шт."
 
-    keyboard = await get_product_keyboard(product_id, user_id)
-    await safe_edit_text(callback.message, text, reply_markup=keyboard)
+    keyboard = await get_product_keyboard(product, qty, page)
+    await safe_edit_text(message_obj, text, reply_markup=keyboard)
+
+
+async def render_product_view(callback: CallbackQuery, product: dict, qty: int, page: int = 0, notify: str = None):
+    await render_product_message(callback.message, product, qty, page)
     await callback.answer(notify if notify else None)
 
 
+quantity_debouncer = QuantityDebouncer(carts.change_cart_quantity, render_product_message)
+
+
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
     user_id = message.from_user.id
     username = message.from_user.username
     first_name = message.from_user.first_name
     
-    await db.get_or_create_user(user_id, username, first_name)
+    await users.ensure(user_id, username, first_name)
     
     await send_photo_message(
         message,
@@ -243,8 +362,194 @@ async def cmd_start(message: Message):
     )
 
 
+@dp.message(Command("stats"))
+async def cmd_stats(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    await message.answer(metrics.format_stats())
+
+
+@dp.message(Command("report"))
+async def cmd_report(message: Message, command: CommandObject):
+    """/report [ДД.ММ.ГГГГ [ДД.ММ.ГГГГ]] — продажи по товарам за день или период (по умолчанию сегодня)."""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    try:
+        date_from, date_to = reports.parse_period(command.args or "")
+    except ValueError as e:
+        await message.answer(str(e))
+        return
+    rows = await db.get_daily_sales(date_from, date_to)
+    for text in reports.format_sales_report(rows, date_from, date_to):
+        await message.answer(text)
+
+
+@dp.message(Command("export_orders"))
+async def cmd_export_orders(message: Message, command: CommandObject):
+    """/export_orders [ДД.ММ.ГГГГ [ДД.ММ.ГГГГ]] — CSV со всеми позициями заказов за период."""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    try:
+        date_from, date_to = reports.parse_period(command.args or "")
+    except ValueError as e:
+        await message.answer(str(e))
+        return
+    period = reports.format_period(date_from, date_to)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"orders_{date_from:%Y%m%d}_{date_to:%Y%m%d}.csv")
+        count = await reports.export_orders_csv(db, date_from, date_to, path)
+        if not count:
+            await message.answer(f"За {period} заказов нет.")
+            return
+        await message.answer_document(FSInputFile(path), caption=f"Заказы за {period}: {count} позиций")
+
+
+CAPACITY_HELP = (
+    "/capacity — остатки на сегодня\n"
+    "/capacity ДД.ММ.ГГГГ N — принять ещё N заказов в этот день\n"
+    "/capacity ДД.ММ.ГГГГ N товар — продать ещё N шт. товара в этот день (точное название или id)\n"
+    "Вместо N «-» снимает ограничение."
+)
+
+
+def find_product_exact(query: str):
+    """Товар по id или точному названию (без учёта регистра, ё/е и пунктуации).
+
+    Возвращает (товар, кандидаты): при неоднозначности или отсутствии
+    совпадения товар None, а кандидаты — что показать администратору.
+    """
+    if query.isdigit() and catalog.product(int(query)):
+        return catalog.product(int(query)), []
+    key = tokenize(query)
+    matches = [
+        product
+        for category in catalog.categories()
+        for product in catalog.products(category["id"])
+        if tokenize(product["name"]) == key
+    ]
+    if len(matches) == 1:
+        return matches[0], []
+    if matches:
+        return None, matches
+    return None, [catalog.product(product_id) for product_id in search_index.search(query, limit=5)]
+
+
+@dp.message(Command("capacity"))
+async def cmd_capacity(message: Message, command: CommandObject):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    parts = (command.args or "").split(maxsplit=2)
+    if not parts:
+        lines = [f"🍳 Остатки на {catalog.capacity_day:%d.%m.%Y}:"]
+        lines.append(f"Заказов: {'без ограничения' if catalog.day_remaining is None else catalog.day_remaining}")
+        for category in catalog.categories():
+            for product in catalog.products(category["id"]):
+                remaining = catalog.remaining(product["id"])
+                if remaining is not None:
+                    lines.append(f"• {product['name']}: {remaining} шт.")
+        await message.answer("\n".join(lines) + "\n\n" + CAPACITY_HELP)
+        return
+    try:
+        day = reports.parse_date(parts[0])
+        if len(parts) < 2 or not (parts[1] == "-" or parts[1].isdigit()):
+            raise ValueError(CAPACITY_HELP)
+    except ValueError as e:
+        await message.answer(str(e))
+        return
+    remaining = None if parts[1] == "-" else int(parts[1])
+    limit = "без ограничения" if remaining is None else str(remaining)
+
+    if len(parts) == 2:
+        await db.set_day_capacity(day, remaining)
+        await message.answer(f"Заказов на {day:%d.%m.%Y}: {limit}")
+        return
+    # Нечёткий поиск здесь опасен: опечатка задала бы остаток другому блюду
+    product, candidates = find_product_exact(parts[2])
+    if not product:
+        text = f"Товар «{parts[2]}» не найден или найден не один, ничего не изменено."
+        if candidates:
+            text += "\nУкажите id:\n" + "\n".join(f"• {p['name']} — id {p['id']}" for p in candidates if p)
+        await message.answer(text)
+        return
+    await db.set_product_capacity(day, product["id"], remaining)
+    await message.answer(f"{product['name']} на {day:%d.%m.%Y}: {limit}")
+
+
+@dp.message(Command("cancel_order"))
+async def cmd_cancel_order(message: Message, command: CommandObject):
+    """/cancel_order N — отмена заказа: вместимость и продажи дня возвращаются."""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    if not command.args or not command.args.strip().isdigit():
+        await message.answer("Использование: /cancel_order номер_заказа")
+        return
+    order = await db.cancel_order(int(command.args))
+    if not order:
+        await message.answer("Заказ не найден или уже отменён")
+        return
+    await message.answer(f"Заказ #{order['order_id']} на {order['total']}₽ отменён")
+    try:
+        await bot.send_message(order["user_id"], f"Ваш заказ #{order['order_id']} отменён.")
+    except Exception as e:
+        logger.warning(f"Не удалось сообщить об отмене заказа #{order['order_id']}: {e}")
+
+
+@dp.message(Command("broadcast"))
+async def cmd_broadcast(message: Message, command: CommandObject):
+    """/broadcast текст — рассылка всем; ответом на сообщение — рассылка его копии; без аргументов — прогресс."""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    if command.args:
+        broadcast = await db.create_broadcast(message.chat.id, text=command.args)
+    elif message.reply_to_message:
+        broadcast = await db.create_broadcast(
+            message.chat.id, source_chat_id=message.chat.id, source_message_id=message.reply_to_message.message_id
+        )
+    else:
+        running = await db.get_running_broadcasts()
+        if not running:
+            await message.answer(
+                "Активных рассылок нет.\n\n"
+                "/broadcast текст — разослать текст всем пользователям\n"
+                "/broadcast ответом на сообщение — разослать его копию\n"
+                "/broadcast_cancel N — остановить рассылку"
+            )
+            return
+        await message.answer("\n\n".join(format_progress(broadcast) for broadcast in running))
+        return
+    broadcasts.wake()
+    await message.answer(
+        f"📣 Рассылка #{broadcast['id']} запущена: ~{broadcast['total']} получателей. "
+        f"Прогресс будет в этом чате, остановить — /broadcast_cancel {broadcast['id']}"
+    )
+
+
+@dp.message(Command("broadcast_cancel"))
+async def cmd_broadcast_cancel(message: Message, command: CommandObject):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    if not command.args or not command.args.strip().isdigit():
+        await message.answer("Использование: /broadcast_cancel номер_рассылки")
+        return
+    if await db.cancel_broadcast(int(command.args)):
+        await message.answer(f"Рассылка #{int(command.args)} остановлена")
+    else:
+        await message.answer("Рассылка не найдена или уже завершена")
+
+
+@dp.my_chat_member()
+async def on_my_chat_member(event: ChatMemberUpdated):
+    """Пользователь заблокировал бота или снова его запустил — рассылки учитывают это."""
+    if event.chat.type != "private":
+        return
+    status = event.new_chat_member.status
+    if status in ("kicked", "member"):
+        await db.set_user_blocked(event.chat.id, status == "kicked")
+
+
 @dp.callback_query(F.data == "about")
 async def callback_about(callback: CallbackQuery):
+    await quantity_debouncer.flush(callback.message.chat.id)
     await edit_to_photo(
         callback.message,
         ABOUT_TEXT,
@@ -255,138 +560,107 @@ async def callback_about(callback: CallbackQuery):
     await callback.answer()
 
 
-@dp.callback_query(F.data == "menu")
-async def callback_menu(callback: CallbackQuery):
-    await ensure_user(callback)
-    categories = await db.get_categories()
-    keyboard = []
-    for cat in categories:
-        keyboard.append([InlineKeyboardButton(
-            text=cat['name'],
-            callback_data=f"category_{cat['id']}"
-        )])
-    keyboard.append([InlineKeyboardButton(text="🛒 В корзину", callback_data="show_cart")])
-    keyboard.append([InlineKeyboardButton(text="◀️ Назад", callback_data="main_menu")])
-    
+async def show_menu(callback: CallbackQuery, notify: str = None):
+    await quantity_debouncer.flush(callback.message.chat.id)
     await safe_edit_text(
         callback.message,
         "Выберите категорию:",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
+        reply_markup=keyboards.menu()
     )
-    await callback.answer()
+    await callback.answer(notify)
 
 
-@dp.callback_query(F.data.startswith("category_"))
-async def callback_category(callback: CallbackQuery):
+@dp.callback_query(F.data == "menu")
+async def callback_menu(callback: CallbackQuery):
     await ensure_user(callback)
-    category_id = int(callback.data.split("_")[1])
+    await show_menu(callback)
+
+
+async def render_category(callback: CallbackQuery, category_id: int, page: int = 0):
     user_id = callback.from_user.id
-    
-    products = await db.get_products_by_category(category_id)
-    if not products:
-        await callback.answer("В этой категории пока нет товаров", show_alert=True)
-        return
-    
-    keyboard = await get_products_keyboard(category_id, user_id)
-    
-    category_name = next((cat['name'] for cat in await db.get_categories() if cat['id'] == category_id), "Категория")
+    # Отложенные ➕/➖ записываем до чтения корзины, а их перерисовку карточки отменяем:
+    # иначе в списке не будет отметок, а через QTY_DEBOUNCE карточка затрёт список
+    await quantity_debouncer.flush(callback.message.chat.id)
+    page = min(max(page, 0), get_page_count(category_id) - 1)
+    keyboard = await get_products_keyboard(category_id, user_id, page)
+    category_name = get_category_name(category_id)
     
     await safe_edit_text(
         callback.message,
         f"📋 {category_name}\n\nВыберите товар:",
         reply_markup=keyboard
     )
-    await callback.answer()
 
 
-@dp.callback_query(F.data.startswith("product_"))
-async def callback_product(callback: CallbackQuery):
-    await ensure_user(callback)
-    product_id = int(callback.data.split("_")[1])
-    user_id = callback.from_user.id
-    
-    product = await db.get_product(product_id)
-    if not product:
-        await callback.answer("Товар не найден", show_alert=True)
-        return
-    
-    # Сохраняем category_id для возврата назад
-    dp.current_state = getattr(dp, 'current_state', {})
-    dp.current_state[user_id] = {'category_id': product['category_id']}
-    
-    await render_product_view(callback, product, user_id)
+def is_stale(callback_data) -> bool:
+    """Кнопка отрисована со старой версией каталога."""
+    if callback_data.v != catalog.version:
+        logger.debug(f"Устаревшая кнопка: версия {callback_data.v}, текущая {catalog.version}")
+        return True
+    return False
 
 
-@dp.callback_query(F.data.startswith("add_"))
-async def callback_add_to_cart(callback: CallbackQuery):
+@dp.callback_query(CategoryCB.filter())
+async def callback_category(callback: CallbackQuery, callback_data: CategoryCB):
     await ensure_user(callback)
-    product_id = int(callback.data.split("_")[1])
-    user_id = callback.from_user.id
-    
-    await db.add_to_cart(user_id, product_id)
+    category_id = callback_data.id
     
-    product = await db.get_product(product_id)
-    category_id = product['category_id']
-    
-    # Обновляем клавиатуру товаров
-    keyboard = await get_products_keyboard(category_id, user_id)
-    
-    category_name = next((cat['name'] for cat in await db.get_categories() if cat['id'] == category_id), "Категория")
-    
-    await safe_edit_text(
-        callback.message,
-        f"📋 {category_name}\n\nВыберите товар:",
-        reply_markup=keyboard
-    )
+    if not catalog.category(category_id) and is_stale(callback_data):
+        await show_menu(callback, "Меню обновилось")
+        return
+
+    products = catalog.products(category_id)
+    if not products:
+        await callback.answer("В этой категории пока нет товаров", show_alert=True)
+        return
     
-    await callback.answer("✅ Товар добавлен в корзину", show_alert=False)
+    await render_category(callback, category_id, callback_data.page)
+    await callback.answer()
 
 
-@dp.callback_query(F.data.startswith("remove_"))
-async def callback_remove_from_cart(callback: CallbackQuery):
+@dp.callback_query(ProductCB.filter())
+async def callback_product(callback: CallbackQuery, callback_data: ProductCB):
     await ensure_user(callback)
-    product_id = int(callback.data.split("_")[1])
+    product_id = callback_data.id
     user_id = callback.from_user.id
     
-    await db.remove_from_cart(user_id, product_id)
-    
-    product = await db.get_product(product_id)
-    category_id = product['category_id']
-    
-    # Обновляем клавиатуру товаров
-    keyboard = await get_products_keyboard(category_id, user_id)
-    
-    category_name = next((cat['name'] for cat in await db.get_categories() if cat['id'] == category_id), "Категория")
-    
-    await safe_edit_text(
-        callback.message,
-        f"📋 {category_name}\n\nВыберите товар:",
-        reply_markup=keyboard
-    )
+    product = catalog.product(product_id)
+    if not product:
+        if is_stale(callback_data) and catalog.category(callback_data.c):
+            await render_category(callback, callback_data.c, callback_data.page)
+        await callback.answer("Товар не найден", show_alert=True)
+        return
     
-    await callback.answer("❌ Товар удален из корзины", show_alert=False)
+    await quantity_debouncer.flush(callback.message.chat.id)
+    qty = await carts.get_cart_quantity(user_id, product_id)
+    await render_product_view(callback, product, qty, callback_data.page)
 
 
-@dp.callback_query(F.data.startswith("inc_"))
-async def callback_inc(callback: CallbackQuery):
+@dp.callback_query(QtyCB.filter())
+async def callback_quantity(callback: CallbackQuery, callback_data: QtyCB):
     await ensure_user(callback)
-    product_id = int(callback.data.split("_")[1])
+    product_id = callback_data.id
     user_id = callback.from_user.id
 
-    await db.change_cart_quantity(user_id, product_id, 1)
-    product = await db.get_product(product_id)
-    await render_product_view(callback, product, user_id, notify="Добавили 1 шт.")
-
-
-@dp.callback_query(F.data.startswith("dec_"))
-async def callback_dec(callback: CallbackQuery):
-    await ensure_user(callback)
-    product_id = int(callback.data.split("_")[1])
-    user_id = callback.from_user.id
+    product = catalog.product(product_id)
+    if not product:
+        if callback.message and is_stale(callback_data) and catalog.category(callback_data.c):
+            await render_category(callback, callback_data.c, callback_data.page)
+        await callback.answer("Товар не найден", show_alert=True)
+        return
 
-    await db.change_cart_quantity(user_id, product_id, -1)
-    product = await db.get_product(product_id)
-    await render_product_view(callback, product, user_id, notify="Убрали 1 шт.")
+    delta = 1 if callback_data.d > 0 else -1
+    if callback.message is None:
+        # Кнопка под сообщением из inline-поиска: меняем корзину нажавшего, сообщение не трогаем
+        qty, _ = await carts.change_cart_quantity(user_id, product_id, delta)
+        await callback.answer(f"В корзине: {qty} шт.")
+        return
+    # Запись в БД и перерисовка случатся одним разом после серии нажатий
+    qty = quantity_debouncer.tap(
+        (callback.message.chat.id, callback.message.message_id),
+        user_id, product, delta, callback_data.q, callback.message, callback_data.page
+    )
+    await callback.answer(f"В корзине: {qty} шт.")
 
 
 @dp.callback_query(F.data == "noop")
@@ -394,37 +668,12 @@ async def callback_noop(callback: CallbackQuery):
     await callback.answer()
 
 
-@dp.callback_query(F.data == "back_to_category")
-async def callback_back_to_category(callback: CallbackQuery):
-    await ensure_user(callback)
-    user_id = callback.from_user.id
-    state = getattr(dp, 'current_state', {}).get(user_id, {})
-    category_id = state.get('category_id')
-    
-    if category_id:
-        products = await db.get_products_by_category(category_id)
-        if not products:
-            await callback.answer("В этой категории пока нет товаров", show_alert=True)
-            return
-        
-        keyboard = await get_products_keyboard(category_id, user_id)
-        category_name = next((cat['name'] for cat in await db.get_categories() if cat['id'] == category_id), "Категория")
-        
-        await safe_edit_text(
-            callback.message,
-            f"📋 {category_name}\n\nВыберите товар:",
-            reply_markup=keyboard
-        )
-        await callback.answer()
-    else:
-        await callback_menu(callback)
-
-
 @dp.callback_query(F.data == "checkout")
-async def callback_checkout(callback: CallbackQuery):
+async def callback_checkout(callback: CallbackQuery, state: FSMContext):
     await ensure_user(callback)
     user_id = callback.from_user.id
-    cart_items = await db.get_cart_items(user_id)
+    await quantity_debouncer.flush(callback.message.chat.id)
+    cart_items = await carts.get_cart_items(user_id)
     
     if not cart_items:
         await callback.answer("Ваша корзина пуста", show_alert=True)
@@ -432,8 +681,9 @@ async def callback_checkout(callback: CallbackQuery):
 
     phone = await db.get_user_phone(user_id)
     if not phone:
-        PENDING_PHONE.add(user_id)
-        await callback.message.edit_text(
+        await state.set_state(CheckoutStates.waiting_phone)
+        await safe_edit_text(
+            callback.message,
             "📞 Пожалуйста, отправьте номер телефона одним сообщением для оформления заказа.",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="◀️ В главное меню", callback_data="main_menu")]
@@ -462,18 +712,16 @@ async def callback_show_cart(callback: CallbackQuery):
     await show_cart(callback)
 
 
-@dp.message()
-async def handle_phone_input(message: Message):
+@dp.message(CheckoutStates.waiting_phone)
+async def handle_phone_input(message: Message, state: FSMContext):
     user_id = message.from_user.id
-    if user_id not in PENDING_PHONE:
-        return
     phone = message.text.strip() if message.text else ""
     if len(phone) < 5:
         await message.answer("Номер слишком короткий, отправьте корректный номер.")
         return
 
     await db.set_user_phone(user_id, phone)
-    PENDING_PHONE.discard(user_id)
+    await state.set_state(None)
 
     # После сохранения телефона сразу оформляем заказ
     await finalize_order(
@@ -492,10 +740,11 @@ async def handle_phone_input(message: Message):
 async def check_cart_on_exit(callback: CallbackQuery):
     """Проверяет корзину при выходе из меню"""
     user_id = callback.from_user.id
-    cart_items = await db.get_cart_items(user_id)
+    await quantity_debouncer.flush(callback.message.chat.id)
+    cart_items = await carts.get_cart_items(user_id)
     
     if cart_items:
-        total = await db.get_cart_total(user_id)
+        total = await carts.get_cart_total(user_id)
         text = "🛒 Ваша корзина:\n\n"
         for item in cart_items:
             text += f"• {item['name']} x{item['quantity']} - {item['price'] * item['quantity']}₽\n"
@@ -509,6 +758,7 @@ async def check_cart_on_exit(callback: CallbackQuery):
 @dp.callback_query(F.data == "main_menu")
 async def callback_main_menu(callback: CallbackQuery):
     await ensure_user(callback)
+    await quantity_debouncer.flush(callback.message.chat.id)
     await edit_to_photo(
         callback.message,
         WELCOME_TEXT,
@@ -526,14 +776,145 @@ async def callback_show_cart(callback: CallbackQuery):
     await show_cart(callback)
 
 
-async def main():
+_EPOCH = datetime(1970, 1, 1)
+
+
+def orders_page_cursor(order: dict) -> OrdersCB:
+    """Кнопка следующей страницы: заказы старше этого."""
+    return OrdersCB(t=(order["created_at"] - _EPOCH) // timedelta(microseconds=1), id=order["id"])
+
+
+def format_order_line(order: dict) -> str:
+    names = ", ".join(order["names"])
+    if order["positions"] > len(order["names"]):
+        names += f" и ещё {order['positions'] - len(order['names'])}"
+    return f"#{order['id']} от {order['created_at']:%d.%m.%Y} — {order['total_price']}₽\n{names}"
+
+
+@dp.callback_query(OrdersCB.filter())
+async def callback_orders(callback: CallbackQuery, callback_data: OrdersCB):
+    await ensure_user(callback)
+    await quantity_debouncer.flush(callback.message.chat.id)
+    before = (_EPOCH + timedelta(microseconds=callback_data.t), callback_data.id) if callback_data.t else None
+    # Лишняя строка показывает, есть ли следующая страница
+    orders = await db.get_orders_page(callback.from_user.id, ORDERS_PAGE_SIZE + 1, before)
+    has_more = len(orders) > ORDERS_PAGE_SIZE
+    orders = orders[:ORDERS_PAGE_SIZE]
+
+    if not orders:
+        text = "📦 У вас пока нет заказов." if before is None else "📦 Более ранних заказов нет."
+    else:
+        text = "📦 Ваши заказы:\n\n" + "\n\n".join(format_order_line(order) for order in orders)
+    rows = [
+        [InlineKeyboardButton(text=f"🔁 Повторить #{order['id']}", callback_data=ReorderCB(id=order["id"]).pack())]
+        for order in orders
+    ]
+    nav = []
+    if before is not None:
+        nav.append(InlineKeyboardButton(text="⏮ К последним", callback_data=OrdersCB().pack()))
+    if has_more:
+        nav.append(InlineKeyboardButton(text="Ранее ▶️", callback_data=orders_page_cursor(orders[-1]).pack()))
+    if nav:
+        rows.append(nav)
+    rows.append([InlineKeyboardButton(text="◀️ В главное меню", callback_data="main_menu")])
+    await safe_edit_text(callback.message, text, reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+    await callback.answer()
+
+
+@dp.callback_query(ReorderCB.filter())
+async def callback_reorder(callback: CallbackQuery, callback_data: ReorderCB):
+    await ensure_user(callback)
+    user_id = callback.from_user.id
+    # Позиции копируются прямо в cart_items, поэтому сначала пишем несохранённые изменения корзины
+    await quantity_debouncer.flush(callback.message.chat.id)
+    await carts.flush(user_id)
+    added, ordered = await db.reorder(user_id, callback_data.id)
+    carts.invalidate(user_id)
+    if not ordered:
+        await callback.answer("Заказ не найден", show_alert=True)
+        return
+    if not added:
+        await callback.answer("Товаров из этого заказа больше нет в меню", show_alert=True)
+        return
+    notify = None if added == ordered else f"Добавлено {added} из {ordered}: остальных товаров нет в меню"
+    await show_cart(callback, notify)
+
+
+def product_summary(product: dict) -> str:
+    return f"{product['weight']} — {product['price']}₽" if product.get('weight') else f"{product['price']}₽"
+
+
+@dp.inline_query()
+async def inline_search(inline_query: InlineQuery):
+    """Поиск по меню: @бот оливье. Ответ строится из индекса в памяти, без запросов к БД."""
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    product_ids = search_index.search(inline_query.query, offset=offset)
+    results = []
+    for product_id in product_ids:
+        product = catalog.product(product_id)
+        if not product:
+            continue
+        results.append(InlineQueryResultArticle(
+            id=str(product_id),
+            title=product['name'],
+            description=product_summary(product),
+            input_message_content=InputTextMessageContent(
+                message_text=f"{product['name']}\n{product_summary(product)}"
+            ),
+            # Добавление — явное нажатие с ответом, а не chosen_inline_result, который может не прийти
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+                InlineKeyboardButton(
+                    text="🛒 В корзину",
+                    callback_data=QtyCB(id=product_id, d=1, c=product['category_id'], v=catalog.version).pack()
+                ),
+                InlineKeyboardButton(text="🔍 Найти ещё", switch_inline_query_current_chat="")
+            ]])
+        ))
+    next_offset = str(offset + len(product_ids)) if len(product_ids) == SEARCH_RESULTS_LIMIT else ""
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False, next_offset=next_offset)
+
+
+@dp.callback_query()
+async def callback_unknown(callback: CallbackQuery):
+    """Кнопки старого формата (до перехода на CallbackData) — просто открываем меню."""
+    await ensure_user(callback)
+    await show_menu(callback, "Меню обновилось")
+
+
+@dp.startup()
+async def on_startup():
     await db.connect()
     logger.info("База данных подключена")
-    
-    try:
+    await catalog.start()
+    await users.start()
+    await state_store.start()
+    await notifier.start()
+    await broadcasts.start()
+    await carts.start()
+    global metrics_runner
+    metrics_runner = await metrics.start_metrics_server()
+
+
+@dp.shutdown()
+async def on_shutdown():
+    if metrics_runner:
+        await metrics_runner.cleanup()
+    await notifier.stop()
+    await broadcasts.stop()
+    await quantity_debouncer.stop()
+    await carts.stop()
+    await state_store.stop()
+    await users.stop()
+    await catalog.stop()
+    await db.disconnect()
+    await outbound.stop()
+
+
+async def main():
+    if BOT_MODE == "webhook":
+        await run_webhook(dp, bot)
+    else:
         await dp.start_polling(bot)
-    finally:
-        await db.disconnect()
 
 
 if __name__ == "__main__":
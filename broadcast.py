@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import timedelta
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+import metrics
+from outbound import LANE_BACKGROUND, outbound_lane
+from ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Сколько получателей брать из БД за раз; после каждой пачки прогресс сохраняется
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", "100"))
+# Сколько сообщений рассылки одновременно ждут отправки в OutboundScheduler
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+# Рассылку ведёт один процесс; если он упал, другой подхватит её через столько секунд
+BROADCAST_LEASE = int(os.getenv("BROADCAST_LEASE", "120"))
+BROADCAST_POLL_INTERVAL = float(os.getenv("BROADCAST_POLL_INTERVAL", "30"))
+# Как часто обновлять сообщение с прогрессом у администратора, секунды
+BROADCAST_REPORT_INTERVAL = float(os.getenv("BROADCAST_REPORT_INTERVAL", "15"))
+
+broadcast_messages = metrics.registry.counter("bot_broadcast_messages_total", "Сообщения рассылок по результату")
+
+STATUS_TITLES = {"running": "идёт", "done": "завершена", "cancelled": "отменена"}
+
+
+def format_progress(broadcast: Dict, rate: Optional[float] = None) -> str:
+    """Сообщение о ходе рассылки; rate — сообщений в секунду в текущем запуске."""
+    done = broadcast["sent"] + broadcast["failed"] + broadcast["blocked"]
+    total = max(broadcast["total"], done)
+    percent = done * 100 // total if total else 100
+    text = (
+        f"📣 Рассылка #{broadcast['id']}: {STATUS_TITLES.get(broadcast['status'], broadcast['status'])}\n"
+        f"Обработано {done} из ~{total} ({percent}%)\n"
+        f"Доставлено: {broadcast['sent']}, заблокировали бота: {broadcast['blocked']}, ошибок: {broadcast['failed']}"
+    )
+    if rate:
+        text += f"\nСкорость: {rate:.1f} сообщ./с"
+        if broadcast["status"] == "running" and total > done:
+            text += f", осталось ~{timedelta(seconds=round((total - done) / rate))}"
+    return text
+
+
+class BroadcastRunner:
+    """Фоновая отправка рассылок из таблицы broadcasts.
+
+    Получатели читаются пачками по возрастанию users.id, начиная с
+    last_user_id; после каждой пачки прогресс и заблокировавшие бота
+    пользователи сохраняются одной транзакцией, поэтому после перезапуска
+    рассылка продолжается с места остановки (пачка, прерванная падением,
+    отправляется заново). Сообщения идут в фоновой полосе OutboundScheduler:
+    с максимальной скоростью, которую допускают лимиты Telegram, и без
+    задержки ответов пользователям.
+    """
+
+    def __init__(self, db, bot: Bot, limiter: RateLimiter):
+        self.db = db
+        self.bot = bot
+        self.limiter = limiter
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def wake(self):
+        """Создана новая рассылка — не ждём очередного опроса."""
+        self._wake.set()
+
+    async def _run(self):
+        outbound_lane.set(LANE_BACKGROUND)
+        while True:
+            try:
+                broadcast = await self.db.claim_broadcast(BROADCAST_LEASE)
+                if broadcast:
+                    await self._deliver(broadcast)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Аренда истечёт, и рассылку продолжит этот или другой процесс
+                logger.error(f"Ошибка рассылки: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=BROADCAST_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _deliver(self, broadcast: Dict):
+        logger.info(f"Рассылка #{broadcast['id']}: продолжаем после пользователя {broadcast['last_user_id']}")
+        semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        started_at = time.monotonic()
+        started_done = broadcast["sent"] + broadcast["failed"] + broadcast["blocked"]
+        reported_at = 0.0
+
+        def rate() -> float:
+            done = broadcast["sent"] + broadcast["failed"] + broadcast["blocked"] - started_done
+            return done / max(time.monotonic() - started_at, 1e-3)
+
+        while True:
+            user_ids = await self.db.get_broadcast_recipients(broadcast["last_user_id"], BROADCAST_BATCH)
+            if not user_ids:
+                break
+            results: Dict[int, str] = {}
+            pending = user_ids
+            while pending:
+                sent = await asyncio.gather(
+                    *(self._send(broadcast, user_id, semaphore) for user_id in pending), return_exceptions=True
+                )
+                flooded, retry_after = [], 0
+                for user_id, result in zip(pending, sent):
+                    if isinstance(result, TelegramRetryAfter):
+                        flooded.append(user_id)
+                        retry_after = max(retry_after, result.retry_after)
+                    elif isinstance(result, BaseException):
+                        # Сеть или Bot API недоступны: пачка не сохраняется и будет отправлена заново
+                        raise result
+                    else:
+                        results[user_id] = result
+                if flooded:
+                    # Долгий flood wait (дольше, чем ждёт OutboundScheduler): весь бот молчит
+                    # retry_after, пачка не сохраняется, недоставленным отправляем после паузы.
+                    # Аренду продлеваем на время паузы — заодно узнаём об отмене.
+                    logger.warning(f"Рассылка #{broadcast['id']}: 429, пауза {retry_after} с")
+                    self.limiter.pause_all(retry_after)
+                    broadcast = await self.db.save_broadcast_progress(
+                        broadcast["id"], broadcast["last_user_id"], 0, 0, [], BROADCAST_LEASE + retry_after
+                    )
+                    if broadcast["status"] != "running":
+                        await self._report(broadcast, rate())
+                        return
+                    await asyncio.sleep(retry_after)
+                pending = flooded
+            statuses = [results[user_id] for user_id in user_ids]
+            blocked = [user_id for user_id in user_ids if results[user_id] == "blocked"]
+            broadcast = await self.db.save_broadcast_progress(
+                broadcast["id"], user_ids[-1], statuses.count("sent"), statuses.count("failed"), blocked,
+                BROADCAST_LEASE
+            )
+            if broadcast["status"] != "running":
+                logger.info(f"Рассылка #{broadcast['id']} остановлена: {broadcast['status']}")
+                await self._report(broadcast, rate())
+                return
+            if time.monotonic() - reported_at >= BROADCAST_REPORT_INTERVAL:
+                reported_at = time.monotonic()
+                await self._report(broadcast, rate())
+
+        await self.db.finish_broadcast(broadcast["id"])
+        broadcast["status"] = "done"
+        logger.info(f"Рассылка #{broadcast['id']} завершена: {broadcast['sent']} доставлено")
+        await self._report(broadcast, rate())
+
+    async def _send(self, broadcast: Dict, user_id: int, semaphore: asyncio.Semaphore) -> str:
+        async with semaphore:
+            try:
+                if broadcast["text"] is not None:
+                    await self.bot.send_message(user_id, broadcast["text"])
+                else:
+                    await self.bot.copy_message(user_id, broadcast["source_chat_id"], broadcast["source_message_id"])
+                result = "sent"
+            except TelegramForbiddenError:
+                # Бот заблокирован или аккаунт удалён — следующие рассылки пользователя пропустят
+                result = "blocked"
+            except TelegramBadRequest as e:
+                # TelegramRetryAfter не ловим: это пауза всей пачки, а не ошибка получателя
+                logger.warning(f"Рассылка #{broadcast['id']}: не отправлено пользователю {user_id}: {e}")
+                result = "failed"
+            broadcast_messages.inc(result=result)
+            return result
+
+    async def _report(self, broadcast: Dict, rate: float):
+        """Обновляет у администратора одно сообщение с прогрессом; его id хранится в рассылке.
+
+        Долгий flood wait в чате администратора рассылку не прерывает:
+        промежуточный прогресс пропускается до следующего отчёта, итоговый
+        отправляется один раз после паузы.
+        """
+        text = format_progress(broadcast, rate)
+        for attempt in range(2):
+            try:
+                await self._show_progress(broadcast, text)
+                return
+            except TelegramRetryAfter as e:
+                logger.warning(f"Прогресс рассылки #{broadcast['id']}: 429, пауза {e.retry_after} с")
+                if broadcast["status"] == "running" or attempt:
+                    return
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                logger.debug(f"Не удалось обновить прогресс рассылки #{broadcast['id']}: {e}")
+                return
+
+    async def _show_progress(self, broadcast: Dict, text: str):
+        if broadcast["progress_message_id"]:
+            await self.bot.edit_message_text(
+                text, chat_id=broadcast["admin_chat_id"], message_id=broadcast["progress_message_id"]
+            )
+            return
+        message = await self.bot.send_message(broadcast["admin_chat_id"], text)
+        broadcast["progress_message_id"] = message.message_id
+        await self.db.set_broadcast_progress_message(broadcast["id"], message.message_id)
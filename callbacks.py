@@ -0,0 +1,42 @@
+from aiogram.filters.callback_data import CallbackData
+
+# Фабрики callback_data. Кнопка несёт всё, что нужно следующему экрану,
+# поэтому навигация назад и листание не читают состояние на сервере.
+# v — версия каталога, с которой отрисована кнопка: по ней видно устаревшие кнопки.
+# Префиксы и имена полей короткие: callback_data ограничен 64 байтами.
+
+
+class CategoryCB(CallbackData, prefix="c"):
+    """Список товаров категории id на странице page."""
+    id: int
+    page: int = 0
+    v: int = 0
+
+
+class ProductCB(CallbackData, prefix="p"):
+    """Карточка товара id; c и page — куда вернуться."""
+    id: int
+    c: int
+    page: int = 0
+    v: int = 0
+
+
+class QtyCB(CallbackData, prefix="q"):
+    """Изменение количества товара id на d в карточке товара; q — количество на момент отрисовки."""
+    id: int
+    d: int
+    c: int
+    q: int = 0
+    page: int = 0
+    v: int = 0
+
+
+class OrdersCB(CallbackData, prefix="o"):
+    """Страница «Мои заказы»: заказы старше (t, id); t — created_at в микросекундах, 0 — первая страница."""
+    t: int = 0
+    id: int = 0
+
+
+class ReorderCB(CallbackData, prefix="r"):
+    """Повторить заказ id: его позиции добавляются в корзину."""
+    id: int
@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# db — каждая операция с корзиной идёт в cart_items; memory — корзины в памяти с отложенной записью
+CART_ENGINE = os.getenv("CART_ENGINE", "db").strip().lower()
+CART_FLUSH_INTERVAL = float(os.getenv("CART_FLUSH_INTERVAL_MS", "500")) / 1000
+CART_CACHE_SIZE = int(os.getenv("CART_CACHE_SIZE", "10000"))
+# Через сколько секунд без обращений корзина выгружается из памяти
+CART_TTL = float(os.getenv("CART_TTL", "1800"))
+
+
+class CartEngine(ABC):
+    """Операции с корзиной, которыми пользуются обработчики.
+
+    Интерфейс повторяет методы корзины в Database, чтобы движки были взаимозаменяемы.
+    """
+
+    @abstractmethod
+    async def get_cart_items(self, user_id: int) -> List[Dict]:
+        pass
+
+    @abstractmethod
+    async def get_cart_total(self, user_id: int) -> int:
+        pass
+
+    @abstractmethod
+    async def get_cart_quantity(self, user_id: int, product_id: int) -> int:
+        pass
+
+    @abstractmethod
+    async def get_cart_quantities(self, user_id: int) -> Dict[int, int]:
+        pass
+
+    @abstractmethod
+    async def change_cart_quantity(self, user_id: int, product_id: int, delta: int) -> Tuple[int, int]:
+        pass
+
+    async def flush(self, user_id: Optional[int] = None):
+        """Дописывает в БД несохранённые изменения (перед оформлением заказа)."""
+
+    def invalidate(self, user_id: int):
+        """Корзина изменилась в БД в обход движка."""
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class DatabaseCarts(CartEngine):
+    """Без кеша: каждый вызов — запрос к БД."""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def get_cart_items(self, user_id: int) -> List[Dict]:
+        return await self.db.get_cart_items(user_id)
+
+    async def get_cart_total(self, user_id: int) -> int:
+        return await self.db.get_cart_total(user_id)
+
+    async def get_cart_quantity(self, user_id: int, product_id: int) -> int:
+        return await self.db.get_cart_quantity(user_id, product_id)
+
+    async def get_cart_quantities(self, user_id: int) -> Dict[int, int]:
+        return await self.db.get_cart_quantities(user_id)
+
+    async def change_cart_quantity(self, user_id: int, product_id: int, delta: int) -> Tuple[int, int]:
+        return await self.db.change_cart_quantity(user_id, product_id, delta)
+
+
+class _Cart:
+    __slots__ = ("product_ids", "quantities", "total", "dirty", "missing", "used_at")
+
+    def __init__(self):
+        self.product_ids = array("i")
+        self.quantities = array("i")
+        self.total = 0
+        self.dirty: Set[int] = set()  # product_id, чьё количество ещё не записано в БД
+        self.missing: Dict[int, Dict] = {}  # товары из БД, которых ещё нет в каталоге процесса
+        self.used_at = time.monotonic()
+
+    def quantity(self, product_id: int) -> int:
+        try:
+            return self.quantities[self.product_ids.index(product_id)]
+        except ValueError:
+            return 0
+
+    def set_quantity(self, product_id: int, quantity: int):
+        try:
+            index = self.product_ids.index(product_id)
+        except ValueError:
+            if quantity > 0:
+                self.product_ids.append(product_id)
+                self.quantities.append(quantity)
+            return
+        if quantity > 0:
+            self.quantities[index] = quantity
+        else:
+            del self.product_ids[index]
+            del self.quantities[index]
+
+
+class MemoryCarts(CartEngine):
+    """Активные корзины в памяти процесса с отложенной пакетной записью в cart_items.
+
+    Корзина загружается из БД при первом обращении, сумма пересчитывается
+    по ценам из каталога в памяти при каждом изменении. Изменённые позиции
+    раз в CART_FLUSH_INTERVAL пишутся в БД одним запросом на все корзины;
+    перед оформлением заказа корзина пользователя записывается немедленно.
+    Чистые корзины вытесняются по LRU (CART_CACHE_SIZE) и по простою (CART_TTL).
+
+    Подходит, когда пользователь обслуживается одним процессом бота:
+    другие реплики не видят несохранённых изменений.
+    """
+
+    def __init__(self, db, catalog, flush_interval: float = CART_FLUSH_INTERVAL,
+                 size: int = CART_CACHE_SIZE, ttl: float = CART_TTL):
+        self.db = db
+        self.catalog = catalog
+        self.flush_interval = flush_interval
+        self.size = size
+        self.ttl = ttl
+        self._carts: "OrderedDict[int, _Cart]" = OrderedDict()
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        catalog.subscribe(self._on_catalog_change)
+
+    def _price(self, cart: _Cart, product_id: int) -> int:
+        product = self.catalog.product(product_id) or cart.missing.get(product_id)
+        return product["price"] if product else 0
+
+    def _recalculate(self, cart: _Cart):
+        cart.total = sum(qty * self._price(cart, pid) for pid, qty in zip(cart.product_ids, cart.quantities))
+
+    def _on_catalog_change(self, version: int):
+        # Снятые с показа товары убираем из корзин (в БД их удалил импорт),
+        # цены могли поменяться — суммы пересчитываем по новому каталогу
+        for cart in self._carts.values():
+            for product_id in list(cart.product_ids):
+                if self.catalog.product(product_id) is not None:
+                    cart.missing.pop(product_id, None)
+                elif product_id not in cart.missing:
+                    cart.set_quantity(product_id, 0)
+                    cart.dirty.discard(product_id)
+            self._recalculate(cart)
+
+    async def _cart(self, user_id: int) -> _Cart:
+        cart = self._carts.get(user_id)
+        if cart is None:
+            # Параллельные обращения к ещё не загруженной корзине ждут одну загрузку
+            future = self._loading.get(user_id)
+            if future is None:
+                future = self._loading[user_id] = asyncio.ensure_future(self._load(user_id))
+                future.add_done_callback(lambda _: self._loading.pop(user_id, None))
+            cart = await asyncio.shield(future)
+            self._carts[user_id] = cart
+        self._carts.move_to_end(user_id)
+        cart.used_at = time.monotonic()
+        return cart
+
+    async def _load(self, user_id: int) -> _Cart:
+        cart = _Cart()
+        for item in await self.db.get_cart_items(user_id):
+            cart.set_quantity(item["product_id"], item["quantity"])
+            if self.catalog.product(item["product_id"]) is None:
+                cart.missing[item["product_id"]] = item
+        self._recalculate(cart)
+        self._carts[user_id] = cart
+        self._evict()
+        return cart
+
+    def _evict(self):
+        now = time.monotonic()
+        for user_id in list(self._carts):
+            cart = self._carts[user_id]
+            if len(self._carts) <= self.size and now - cart.used_at < self.ttl:
+                break  # дальше по LRU только более свежие корзины
+            if not cart.dirty:
+                del self._carts[user_id]
+
+    async def get_cart_items(self, user_id: int) -> List[Dict]:
+        cart = await self._cart(user_id)
+        items = []
+        for product_id, quantity in zip(cart.product_ids, cart.quantities):
+            product = self.catalog.product(product_id) or cart.missing.get(product_id)
+            if product is None:
+                continue
+            items.append({
+                "product_id": product_id,
+                "quantity": quantity,
+                "name": product["name"],
+                "price": product["price"],
+                "weight": product["weight"],
+            })
+        return items
+
+    async def get_cart_total(self, user_id: int) -> int:
+        return (await self._cart(user_id)).total
+
+    async def get_cart_quantity(self, user_id: int, product_id: int) -> int:
+        return (await self._cart(user_id)).quantity(product_id)
+
+    async def get_cart_quantities(self, user_id: int) -> Dict[int, int]:
+        cart = await self._cart(user_id)
+        return dict(zip(cart.product_ids, cart.quantities))
+
+    async def change_cart_quantity(self, user_id: int, product_id: int, delta: int) -> Tuple[int, int]:
+        cart = await self._cart(user_id)
+        if delta > 0 and self.catalog.product(product_id) is None:
+            # Товара нет в меню — в корзину его не кладём
+            return cart.quantity(product_id), cart.total
+        old = cart.quantity(product_id)
+        new = max(0, old + delta)
+        if new != old:
+            cart.set_quantity(product_id, new)
+            cart.total += (new - old) * self._price(cart, product_id)
+            cart.dirty.add(product_id)
+        return new, cart.total
+
+    def invalidate(self, user_id: int):
+        self._carts.pop(user_id, None)
+
+    async def flush(self, user_id: Optional[int] = None):
+        # Под замком: фоновая запись, начатая раньше, успевает завершиться до оформления заказа
+        async with self._flush_lock:
+            user_ids = [user_id] if user_id is not None else list(self._carts)
+            rows = []
+            flushed = []
+            for uid in user_ids:
+                cart = self._carts.get(uid)
+                if cart is None or not cart.dirty:
+                    continue
+                written = {product_id: cart.quantity(product_id) for product_id in cart.dirty}
+                rows.extend((uid, product_id, quantity) for product_id, quantity in written.items())
+                flushed.append((cart, written))
+            if not rows:
+                return
+            # Отметки снимаем только после успешной записи: пока запрос идёт, корзина
+            # остаётся «грязной» и _evict её не выгрузит (иначе чтение вернуло бы
+            # из БД старые количества, а при ошибке изменения пропали бы)
+            await self.db.save_cart_items(rows)
+            for cart, written in flushed:
+                # Позиции, изменённые во время записи, остаются до следующего раза
+                cart.dirty -= {pid for pid, quantity in written.items() if cart.quantity(pid) == quantity}
+
+    async def start(self):
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Не удалось записать корзины: {e}")
+            self._evict()
+
+
+def build_cart_engine(db, catalog) -> CartEngine:
+    if CART_ENGINE == "memory":
+        return MemoryCarts(db, catalog)
+    if CART_ENGINE != "db":
+        logger.warning(f"Неизвестный CART_ENGINE={CART_ENGINE}, используем db")
+    return DatabaseCarts(db)
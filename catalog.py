@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import os
+from datetime import date
+from typing import Callable, Dict, List, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CHANNEL = "catalog_changed"
+CAPACITY_CHANNEL = "capacity_changed"
+# Страховочная сверка версии на случай потерянного NOTIFY, секунды
+CATALOG_POLL_INTERVAL = float(os.getenv("CATALOG_POLL_INTERVAL", "60"))
+# Снимок читается с реплики: если она ещё не догнала версию из NOTIFY, повторяем через паузу
+CATALOG_LAG_RETRY = 0.5
+CATALOG_LAG_ATTEMPTS = 20
+
+
+class Catalog:
+    """Меню в памяти процесса: категории и товары с индексами по id.
+
+    Загружается целиком из БД и перезагружается по NOTIFY catalog_changed,
+    который рассылают триггеры на categories и products. Версия каталога
+    хранится в БД, поэтому все процессы бота видят одну и ту же версию.
+
+    Здесь же лежат остатки вместимости кухни на сегодня: они меняются с
+    каждым заказом, поэтому перечитываются отдельно от каталога по NOTIFY
+    capacity_changed и не сбрасывают версию каталога и шаблоны клавиатур.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.version: int = -1
+        self._categories: List[Dict] = []
+        self._categories_by_id: Dict[int, Dict] = {}
+        self._products_by_id: Dict[int, Dict] = {}
+        self._products_by_category: Dict[int, List[Dict]] = {}
+        self._listener: Optional[asyncpg.Connection] = None
+        self._reload_task: Optional[asyncio.Task] = None
+        self._reload_pending = False
+        self._notified_version = -1
+        self._watch_task: Optional[asyncio.Task] = None
+        self._subscribers: List[Callable[[int], None]] = []
+        self.capacity_day: Optional[date] = None
+        self.day_remaining: Optional[int] = None  # сколько ещё заказов примем сегодня, None — без ограничения
+        self._remaining: Dict[int, int] = {}
+        self._capacity_task: Optional[asyncio.Task] = None
+        self._capacity_pending = False
+
+    def subscribe(self, callback: Callable[[int], None]):
+        """callback(version) вызывается после каждой перезагрузки каталога."""
+        self._subscribers.append(callback)
+
+    async def start(self):
+        await self.reload()
+        await self.reload_capacity()
+        self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watch_task:
+            self._watch_task.cancel()
+            await asyncio.gather(self._watch_task, return_exceptions=True)
+        await self._close_listener()
+
+    async def reload(self):
+        version, categories, products = await self.db.get_catalog_snapshot()
+        # Отстающая реплика не должна откатить каталог на старую версию
+        if version <= self.version:
+            return
+
+        categories_by_id = {cat["id"]: cat for cat in categories}
+        products_by_category: Dict[int, List[Dict]] = {cat["id"]: [] for cat in categories}
+        for product in products:
+            products_by_category.setdefault(product["category_id"], []).append(product)
+
+        # Подменяем все индексы разом, читатели никогда не видят половину обновления
+        self._categories = categories
+        self._categories_by_id = categories_by_id
+        self._products_by_id = {product["id"]: product for product in products}
+        self._products_by_category = products_by_category
+        self.version = version
+        logger.info(f"Каталог загружен: версия {version}, {len(categories)} категорий, {len(products)} товаров")
+        for callback in self._subscribers:
+            try:
+                callback(version)
+            except Exception as e:
+                logger.error(f"Ошибка подписчика каталога {callback!r}: {e}")
+
+    def categories(self) -> List[Dict]:
+        return self._categories
+
+    def category(self, category_id: int) -> Optional[Dict]:
+        return self._categories_by_id.get(category_id)
+
+    def products(self, category_id: int) -> List[Dict]:
+        return self._products_by_category.get(category_id, [])
+
+    def product(self, product_id: int) -> Optional[Dict]:
+        return self._products_by_id.get(product_id)
+
+    def remaining(self, product_id: int) -> Optional[int]:
+        """Сколько товара ещё можно заказать сегодня; None — без ограничения."""
+        return self._remaining.get(product_id)
+
+    async def reload_capacity(self):
+        day, remaining, day_remaining = await self.db.get_capacity()
+        self.capacity_day, self._remaining, self.day_remaining = day, remaining, day_remaining
+
+    def _on_capacity_notify(self, connection, pid, channel, payload):
+        # Изменения других дней на сегодняшние остатки не влияют
+        if payload and self.capacity_day and payload != self.capacity_day.isoformat():
+            return
+        self._schedule_capacity_reload()
+
+    def _schedule_capacity_reload(self):
+        # Поток заказов схлопывается: пока идёт перечитывание, копится одно следующее
+        if self._capacity_task and not self._capacity_task.done():
+            self._capacity_pending = True
+            return
+        self._capacity_task = asyncio.create_task(self._capacity_loop())
+
+    async def _capacity_loop(self):
+        while True:
+            self._capacity_pending = False
+            try:
+                await self.reload_capacity()
+            except Exception as e:
+                logger.error(f"Не удалось перечитать вместимость: {e}")
+            if not self._capacity_pending:
+                return
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            version = int(payload)
+            if version <= self.version:
+                return
+            self._notified_version = max(self._notified_version, version)
+        except ValueError:
+            pass
+        self._schedule_reload()
+
+    def _schedule_reload(self):
+        # Пачка NOTIFY во время перезагрузки схлопывается в одну дополнительную перезагрузку
+        if self._reload_task and not self._reload_task.done():
+            self._reload_pending = True
+            return
+        self._reload_task = asyncio.create_task(self._reload_loop())
+
+    async def _reload_loop(self):
+        lagging = 0
+        while True:
+            self._reload_pending = False
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.error(f"Не удалось перезагрузить каталог: {e}")
+            if self.version < self._notified_version and lagging < CATALOG_LAG_ATTEMPTS:
+                lagging += 1
+                await asyncio.sleep(CATALOG_LAG_RETRY)
+                continue
+            if not self._reload_pending:
+                return
+
+    async def _close_listener(self):
+        if self._listener and not self._listener.is_closed():
+            await self._listener.close()
+        self._listener = None
+
+    async def _watch(self):
+        """Держит LISTEN-соединение и периодически сверяет версию."""
+        while True:
+            try:
+                if self._listener is None or self._listener.is_closed():
+                    self._listener = await self.db.connect_listener()
+                    await self._listener.add_listener(CATALOG_CHANNEL, self._on_notify)
+                    await self._listener.add_listener(CAPACITY_CHANNEL, self._on_capacity_notify)
+                    # Пока соединения не было, каталог мог измениться
+                    self._schedule_reload()
+                    self._schedule_capacity_reload()
+                await asyncio.sleep(CATALOG_POLL_INTERVAL)
+                if await self.db.get_catalog_version() != self.version:
+                    self._schedule_reload()
+                # Заодно переходим на остатки нового дня после полуночи
+                self._schedule_capacity_reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка LISTEN {CATALOG_CHANNEL}: {e}")
+                await self._close_listener()
+                await asyncio.sleep(5)
@@ -0,0 +1,117 @@
+"""Импорт и экспорт меню в CSV или JSON.
+
+    python catalog_io.py import menu.csv
+    python catalog_io.py export menu.json
+
+CSV: колонки category, name, weight, price; порядок категорий и товаров —
+порядок строк в файле. JSON: [{"category": ..., "products": [{"name", "weight", "price"}]}].
+Товары сопоставляются с уже существующими по (категория, название):
+совпавшие обновляются, новые добавляются, отсутствующие в файле снимаются с показа.
+"""
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# (категория, порядок категории, название, вес, цена, порядок в категории)
+CatalogRow = Tuple[str, int, str, Optional[str], int, int]
+
+CSV_FIELDS = ("category", "name", "weight", "price")
+
+
+def _format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in (".csv", ".json"):
+        raise ValueError(f"Неизвестный формат файла {path}: нужен .csv или .json")
+    return ext[1:]
+
+
+def rows_from_groups(groups: List[Tuple[str, List[Tuple[str, Optional[str], int]]]]) -> List[CatalogRow]:
+    """[(категория, [(название, вес, цена)])] -> строки для импорта с порядком из файла."""
+    rows = []
+    seen = set()
+    for category_index, (category, products) in enumerate(groups):
+        for order_index, (name, weight, price) in enumerate(products):
+            category, name = category.strip(), name.strip()
+            if not category or not name:
+                raise ValueError(f"Пустая категория или название товара: {category!r} / {name!r}")
+            if (category, name) in seen:
+                raise ValueError(f"Товар повторяется: {category} / {name}")
+            seen.add((category, name))
+            rows.append((category, category_index, name, (weight or "").strip() or None, int(price), order_index))
+    return rows
+
+
+def read_catalog(path: str) -> List[CatalogRow]:
+    with open(path, encoding="utf-8", newline="") as f:
+        if _format(path) == "json":
+            data = json.load(f)
+            groups = [
+                (item["category"], [(p["name"], p.get("weight"), p["price"]) for p in item.get("products", [])])
+                for item in data
+            ]
+        else:
+            grouped: Dict[str, list] = {}
+            for line in csv.DictReader(f):
+                grouped.setdefault(line["category"], []).append((line["name"], line.get("weight"), line["price"]))
+            groups = list(grouped.items())
+    return rows_from_groups(groups)
+
+
+def write_catalog(path: str, rows: List[Dict]):
+    """rows — результат Database.export_catalog(), уже упорядоченный."""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if _format(path) == "json":
+            groups: Dict[str, list] = {}
+            for row in rows:
+                groups.setdefault(row["category"], []).append(
+                    {"name": row["name"], "weight": row["weight"], "price": row["price"]}
+                )
+            json.dump([{"category": c, "products": p} for c, p in groups.items()], f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        else:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({field: row[field] for field in CSV_FIELDS})
+
+
+def format_stats(stats: Dict[str, int]) -> str:
+    return (
+        f"Категории: +{stats['categories_added']} ~{stats['categories_updated']} -{stats['categories_deactivated']}; "
+        f"товары: +{stats['products_added']} ~{stats['products_updated']} -{stats['products_deactivated']}, "
+        f"без изменений {stats['products_unchanged']}"
+    )
+
+
+async def _main(command: str, path: str):
+    from database import Database
+
+    db = Database()
+    await db.connect()
+    try:
+        start = time.perf_counter()
+        if command == "import":
+            rows = read_catalog(path)
+            stats = await db.import_catalog(rows)
+            print(f"Импортировано {len(rows)} товаров за {time.perf_counter() - start:.3f} с")
+            print(format_stats(stats))
+        else:
+            rows = await db.export_catalog()
+            write_catalog(path, rows)
+            print(f"Выгружено {len(rows)} товаров в {path} за {time.perf_counter() - start:.3f} с")
+    finally:
+        await db.disconnect()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ("import", "export"):
+        print("Использование: python catalog_io.py import|export файл.csv|файл.json")
+        sys.exit(1)
+    load_dotenv()
+    asyncio.run(_main(sys.argv[1], sys.argv[2]))
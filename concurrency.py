@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import os
+from typing import Dict
+
+from aiogram.types import Update
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений обрабатывается одновременно во всём процессе
+MAX_IN_FLIGHT_UPDATES = int(os.getenv("MAX_IN_FLIGHT_UPDATES", "64"))
+# Сколько обновлений одного пользователя может ждать своей очереди; лишние нажатия кнопок отбрасываются
+USER_QUEUE_DEPTH = int(os.getenv("USER_QUEUE_DEPTH", "3"))
+
+updates_dropped = metrics.registry.counter("bot_updates_dropped_total", "Отброшенные нажатия сверх очереди пользователя")
+
+
+class _UserSlot:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0  # выполняется + ждёт
+
+
+class UserSerializer:
+    """Outer-middleware на update: обновления одного пользователя выполняются по одному.
+
+    Разные пользователи обрабатываются параллельно, но не больше
+    MAX_IN_FLIGHT_UPDATES одновременно — всплеск от одного пользователя
+    не займёт весь пул соединений с БД. Если у пользователя в очереди уже
+    USER_QUEUE_DEPTH обновлений, новые нажатия кнопок отбрасываются
+    (callback закрывается без действия); сообщения ждут всегда.
+    Замки пользователей удаляются, как только очередь пустеет.
+    """
+
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT_UPDATES, queue_depth: int = USER_QUEUE_DEPTH):
+        self.queue_depth = queue_depth
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._slots: Dict[int, _UserSlot] = {}
+        metrics.registry.gauge("bot_updates_waiting", "Обновления в очередях пользователей", self._read_waiting)
+
+    def _read_waiting(self):
+        return {(): sum(slot.pending for slot in self._slots.values())}
+
+    async def __call__(self, handler, event: Update, data):
+        user = data.get("event_from_user")
+        if user is None:
+            async with self._in_flight:
+                return await handler(event, data)
+
+        slot = self._slots.get(user.id)
+        if slot is None:
+            slot = self._slots[user.id] = _UserSlot()
+        if event.callback_query is not None and slot.pending >= self.queue_depth:
+            updates_dropped.inc()
+            try:
+                await event.callback_query.answer()
+            except Exception as e:
+                logger.debug(f"Не удалось закрыть отброшенный callback: {e}")
+            return None
+
+        slot.pending += 1
+        try:
+            # Сначала очередь пользователя, потом общий лимит: ожидающие не занимают слоты
+            async with slot.lock:
+                async with self._in_flight:
+                    return await handler(event, data)
+        finally:
+            slot.pending -= 1
+            if slot.pending == 0 and self._slots.get(user.id) is slot:
+                del self._slots[user.id]
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать тишины после последнего нажатия ➕/➖ перед записью и перерисовкой, секунды
+QTY_DEBOUNCE = float(os.getenv("QTY_DEBOUNCE_MS", "400")) / 1000
+
+
+class _Pending:
+    __slots__ = ("user_id", "product", "page", "message", "base", "target", "generation", "timer", "flushing", "silent")
+
+    def __init__(self, user_id: int, product: dict, base: int):
+        self.user_id = user_id
+        self.product = product
+        self.page = 0
+        self.message = None
+        self.base = base  # количество, которое сейчас показано в сообщении / записано в БД
+        self.target = base  # количество с учётом ещё не записанных нажатий
+        self.generation = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.flushing = False
+        self.silent = False  # пользователь ушёл с карточки — записать, но не перерисовывать
+
+
+class QuantityDebouncer:
+    """Схлопывает серию нажатий ➕/➖ в одну запись в БД и одну перерисовку.
+
+    На каждое нажатие сразу возвращается ожидаемое количество (для ответа
+    на callback), изменения копятся по ключу (chat_id, message_id). После
+    паузы QTY_DEBOUNCE итоговая разница пишется одним запросом, и сообщение
+    перерисовывается только с последним состоянием; если во время записи
+    пришли новые нажатия, промежуточная перерисовка пропускается.
+    """
+
+    def __init__(self, apply: Callable[[int, int, int], Awaitable[Tuple[int, int]]],
+                 render: Callable[..., Awaitable], quiet: float = QTY_DEBOUNCE):
+        self.apply = apply
+        self.render = render
+        self.quiet = quiet
+        self._pending: Dict[Hashable, _Pending] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    def tap(self, key: Hashable, user_id: int, product: dict, delta: int, shown_qty: int, message, page: int = 0) -> int:
+        entry = self._pending.get(key)
+        if entry is None or entry.product["id"] != product["id"]:
+            entry = self._pending[key] = _Pending(user_id, product, shown_qty)
+        entry.target = max(0, entry.target + delta)
+        # Новое нажатие — пользователь снова на карточке, её нужно перерисовать
+        entry.silent = False
+        entry.message = message
+        entry.page = page
+        entry.generation += 1
+        if entry.timer:
+            entry.timer.cancel()
+        if not entry.flushing:
+            entry.timer = asyncio.get_running_loop().call_later(self.quiet, self._start_flush, key)
+        return entry.target
+
+    def _start_flush(self, key: Hashable):
+        entry = self._pending.get(key)
+        if entry is None or entry.flushing:
+            return
+        entry.flushing = True
+        entry.timer = None
+        task = self._tasks[key] = asyncio.create_task(self._flush(key, entry))
+        task.add_done_callback(lambda t: self._tasks.pop(key, None) if self._tasks.get(key) is t else None)
+
+    async def _flush(self, key: Hashable, entry: _Pending):
+        generation = entry.generation
+        target = entry.target
+        delta = target - entry.base
+        qty = entry.base
+        try:
+            if delta:
+                qty, _ = await self.apply(entry.user_id, entry.product["id"], delta)
+        except Exception as e:
+            logger.error(f"Не удалось изменить количество товара {entry.product['id']}: {e}")
+        finally:
+            entry.flushing = False
+
+        # Нажатия, пришедшие во время записи, переносим поверх фактического количества
+        entry.target = max(0, qty + entry.target - target)
+        entry.base = qty
+        if entry.generation != generation:
+            # Есть более свежие нажатия: эта перерисовка уже устарела
+            entry.timer = asyncio.get_running_loop().call_later(self.quiet, self._start_flush, key)
+            return
+
+        del self._pending[key]
+        if not delta or entry.silent:
+            return
+        try:
+            await self.render(entry.message, entry.product, qty, entry.page)
+        except Exception as e:
+            logger.error(f"Не удалось перерисовать карточку товара {entry.product['id']}: {e}")
+
+    async def flush(self, chat_id: Optional[int] = None):
+        """Немедленно записывает накопленные нажатия чата (или все, если chat_id не задан).
+
+        Вызывается перед чтением корзины: корзина, оформление, выход в меню.
+        Карточки товаров при этом не перерисовываются — сообщение уже показывает другой экран.
+        """
+        silenced = set()
+        while True:
+            keys = [key for key in self._pending if chat_id is None or key[0] == chat_id]
+            if not keys:
+                return
+            for key in keys:
+                entry = self._pending[key]
+                # Глушим только то, что застали; нажатие после этого снова включит перерисовку
+                if entry not in silenced:
+                    silenced.add(entry)
+                    entry.silent = True
+                if entry.timer:
+                    entry.timer.cancel()
+                    entry.timer = None
+                self._start_flush(key)
+            await asyncio.gather(*(self._tasks[key] for key in keys if key in self._tasks), return_exceptions=True)
+
+    async def stop(self):
+        """Записывает всё накопленное (при остановке бота)."""
+        await self.flush()
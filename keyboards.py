@@ -0,0 +1,132 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from callbacks import CategoryCB, ProductCB
+
+logger = logging.getLogger(__name__)
+
+# Кнопки без параметров одинаковы для всех, объекты aiogram неизменяемы — создаём один раз
+CART_BUTTON = InlineKeyboardButton(text="🛒 В корзину", callback_data="show_cart")
+BACK_TO_MAIN_BUTTON = InlineKeyboardButton(text="◀️ Назад", callback_data="main_menu")
+BACK_TO_MENU_BUTTON = InlineKeyboardButton(text="◀️ Назад к категориям", callback_data="menu")
+
+
+def product_label(product: dict) -> str:
+    name = product['name']
+    if len(name) > 25:
+        name = name[:22] + "..."
+    return name
+
+
+class _PageTemplate:
+    """Готовые строки страницы категории: кнопки товаров без отметок корзины и навигация."""
+
+    __slots__ = ("products", "footer")
+
+    def __init__(self, products: List[Tuple[int, str, int, InlineKeyboardButton]],
+                 footer: List[List[InlineKeyboardButton]]):
+        self.products = products  # (product_id, подпись, цена, кнопка без отметки)
+        self.footer = footer
+
+
+class KeyboardTemplates:
+    """Клавиатуры меню, собранные заранее для текущей версии каталога.
+
+    Список категорий и страницы товаров строятся один раз на версию каталога
+    и сбрасываются, когда каталог перезагружается. При отрисовке для
+    пользователя заменяются только кнопки товаров, которые лежат в его корзине
+    или продаются с ограничением (остаток берётся из каталога в памяти).
+    """
+
+    def __init__(self, catalog, page_size: int):
+        self.catalog = catalog
+        self.page_size = page_size
+        self._menu: Optional[InlineKeyboardMarkup] = None
+        self._categories: Optional[InlineKeyboardMarkup] = None
+        self._pages: Dict[Tuple[int, int], _PageTemplate] = {}
+        catalog.subscribe(self.invalidate)
+
+    def invalidate(self, version: int = None):
+        self._menu = None
+        self._categories = None
+        self._pages = {}
+        logger.debug(f"Шаблоны клавиатур сброшены, версия каталога {version}")
+
+    def page_count(self, category_id: int) -> int:
+        return max(1, -(-len(self.catalog.products(category_id)) // self.page_size))
+
+    def _category_rows(self) -> List[List[InlineKeyboardButton]]:
+        version = self.catalog.version
+        return [
+            [InlineKeyboardButton(text=cat['name'], callback_data=CategoryCB(id=cat['id'], v=version).pack())]
+            for cat in self.catalog.categories()
+        ]
+
+    def menu(self) -> InlineKeyboardMarkup:
+        """Список категорий с кнопкой корзины (экран «Меню»)."""
+        if self._menu is None:
+            self._menu = InlineKeyboardMarkup(
+                inline_keyboard=self._category_rows() + [[CART_BUTTON], [BACK_TO_MAIN_BUTTON]]
+            )
+        return self._menu
+
+    def categories(self) -> InlineKeyboardMarkup:
+        if self._categories is None:
+            self._categories = InlineKeyboardMarkup(inline_keyboard=self._category_rows() + [[BACK_TO_MAIN_BUTTON]])
+        return self._categories
+
+    def _page(self, category_id: int, page: int) -> _PageTemplate:
+        template = self._pages.get((category_id, page))
+        if template is not None:
+            return template
+
+        version = self.catalog.version
+        pages = self.page_count(category_id)
+        products = []
+        for product in self.catalog.products(category_id)[page * self.page_size:(page + 1) * self.page_size]:
+            label = product_label(product)
+            button = InlineKeyboardButton(
+                text=f"{label} - {product['price']}₽",
+                callback_data=ProductCB(id=product['id'], c=category_id, page=page, v=version).pack()
+            )
+            products.append((product['id'], label, product['price'], button))
+
+        footer = []
+        if pages > 1:
+            footer.append([
+                InlineKeyboardButton(
+                    text="◀️",
+                    callback_data=CategoryCB(id=category_id, page=(page - 1) % pages, v=version).pack()
+                ),
+                InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data="noop"),
+                InlineKeyboardButton(
+                    text="▶️",
+                    callback_data=CategoryCB(id=category_id, page=(page + 1) % pages, v=version).pack()
+                ),
+            ])
+        footer.append([CART_BUTTON])
+        footer.append([BACK_TO_MENU_BUTTON])
+
+        template = self._pages[(category_id, page)] = _PageTemplate(products, footer)
+        return template
+
+    def products(self, category_id: int, page: int, cart: Dict[int, int]) -> InlineKeyboardMarkup:
+        """Страница товаров категории; cart — {product_id: количество} в корзине пользователя."""
+        template = self._page(category_id, page)
+        rows = []
+        for product_id, label, price, button in template.products:
+            qty = cart.get(product_id, 0)
+            remaining = self.catalog.remaining(product_id)
+            if qty > 0 or remaining is not None:
+                text = f"✅ {label} x{qty}" if qty > 0 else label
+                if remaining == 0:
+                    text = f"{text} - нет"
+                elif remaining is not None:
+                    text = f"{text} (ост. {remaining}) - {price}₽"
+                else:
+                    text = f"{text} - {price}₽"
+                button = InlineKeyboardButton(text=text, callback_data=button.callback_data)
+            rows.append([button])
+        return InlineKeyboardMarkup(inline_keyboard=rows + template.footer)
@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow не обязателен: без него грузим исходный файл
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", ".media_cache")
+# Формат облегчённой копии для первой загрузки: "jpeg", "webp" или пусто (грузим как есть)
+MEDIA_RECOMPRESS = os.getenv("MEDIA_RECOMPRESS", "").strip().lower()
+MEDIA_MAX_SIDE = int(os.getenv("MEDIA_MAX_SIDE", "1280"))
+MEDIA_QUALITY = int(os.getenv("MEDIA_QUALITY", "85"))
+
+
+def _is_bad_file_id(error: TelegramBadRequest) -> bool:
+    """Telegram отказался принять сохранённый file_id."""
+    text = str(error).lower()
+    return "file identifier" in text or "file_id" in text or "wrong file" in text or "file reference" in text
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _recompress(path: str, content_hash: str, fmt: str) -> str:
+    """Сохраняет уменьшенную JPEG/WebP-копию рядом в кэше и возвращает её путь."""
+    ext = "jpg" if fmt == "jpeg" else fmt
+    target = os.path.join(MEDIA_CACHE_DIR, f"{content_hash[:16]}.{ext}")
+    if os.path.exists(target):
+        return target
+    os.makedirs(MEDIA_CACHE_DIR, exist_ok=True)
+    with Image.open(path) as img:
+        img = img.convert("RGB")
+        img.thumbnail((MEDIA_MAX_SIDE, MEDIA_MAX_SIDE))
+        tmp = target + ".tmp"
+        img.save(tmp, format=fmt.upper(), quality=MEDIA_QUALITY, optimize=True)
+    os.replace(tmp, target)
+    return target
+
+
+class MediaRegistry:
+    """Загружает файл в Telegram один раз и дальше отправляет его по file_id.
+
+    file_id хранится в таблице media_files по ключу (путь, хеш содержимого, вариант),
+    поэтому при изменении файла он загружается заново автоматически.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.variant = MEDIA_RECOMPRESS if MEDIA_RECOMPRESS in ("jpeg", "webp") and Image else "original"
+        if MEDIA_RECOMPRESS and self.variant == "original":
+            logger.warning(f"MEDIA_RECOMPRESS={MEDIA_RECOMPRESS} недоступен (нужен Pillow), отправляем исходные файлы")
+        # path -> (mtime_ns, size, hash): не пересчитываем хеш, пока файл не менялся
+        self._hashes: Dict[str, Tuple[int, int, str]] = {}
+        # (path, hash) -> file_id
+        self._file_ids: Dict[Tuple[str, str], str] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def _content_hash(self, path: str) -> str:
+        st = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        content_hash = await asyncio.to_thread(_file_hash, path)
+        self._hashes[path] = (st.st_mtime_ns, st.st_size, content_hash)
+        return content_hash
+
+    async def get_file_id(self, path: str) -> Optional[str]:
+        content_hash = await self._content_hash(path)
+        key = (path, content_hash)
+        if key not in self._file_ids:
+            file_id = await self.db.get_media_file_id(path, content_hash, self.variant)
+            if not file_id:
+                return None
+            self._file_ids[key] = file_id
+        return self._file_ids[key]
+
+    async def _input_file(self, path: str) -> FSInputFile:
+        if self.variant == "original":
+            return FSInputFile(path)
+        content_hash = await self._content_hash(path)
+        try:
+            upload_path = await asyncio.to_thread(_recompress, path, content_hash, self.variant)
+        except Exception as e:
+            logger.warning(f"Не удалось пережать {path} ({e}), отправляем исходный файл")
+            return FSInputFile(path)
+        return FSInputFile(upload_path, filename=os.path.basename(upload_path))
+
+    async def _remember(self, path: str, message) -> None:
+        if not isinstance(message, Message) or not message.photo:
+            return
+        file_id = message.photo[-1].file_id
+        content_hash = await self._content_hash(path)
+        self._file_ids[(path, content_hash)] = file_id
+        await self.db.save_media_file_id(path, content_hash, self.variant, file_id)
+        logger.info(f"Файл {path} загружен в Telegram, file_id сохранён")
+
+    async def forget(self, path: str) -> None:
+        content_hash = await self._content_hash(path)
+        self._file_ids.pop((path, content_hash), None)
+        await self.db.delete_media_file_id(path, content_hash, self.variant)
+
+    async def send(self, path: str, send: Callable[[Union[str, FSInputFile]], Awaitable]):
+        """Вызывает send(photo) с file_id, а если его нет или он отвергнут — с загрузкой файла."""
+        file_id = await self.get_file_id(path)
+        if file_id:
+            try:
+                return await send(file_id)
+            except TelegramBadRequest as e:
+                if not _is_bad_file_id(e):
+                    raise
+                logger.warning(f"Telegram отверг сохранённый file_id для {path} ({e}), загружаем заново")
+                await self.forget(path)
+
+        # Один аплоад на файл: параллельные запросы дождутся file_id первого
+        lock = self._locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            file_id = await self.get_file_id(path)
+            if file_id:
+                return await send(file_id)
+            message = await send(await self._input_file(path))
+            await self._remember(path, message)
+            return message
@@ -0,0 +1,258 @@
+import bisect
+import logging
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 — отдельный HTTP-сервер не поднимаем
+# Запросы к БД дольше порога пишутся в лог; 0 — не писать
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "0"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in self.values.items()]
+        return lines
+
+
+class Gauge:
+    """Значение снимается в момент выдачи метрик через функцию."""
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], Dict[Labels, float]]):
+        self.name = name
+        self.help = help_text
+        self.read = read
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in self.read().items()]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по корзинам + корзина +Inf, сумма, количество]
+        self.values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        item = self.values.get(key)
+        if item is None:
+            item = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        item[0][bisect.bisect_left(self.buckets, value)] += 1
+        item[1] += value
+        item[2] += 1
+
+    def quantile(self, q: float, **labels) -> float:
+        """Оценка квантиля по корзинам (верхняя граница корзины)."""
+        item = self.values.get(_labels(labels))
+        if not item or not item[2]:
+            return 0.0
+        rank = q * item[2]
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), item[0]):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else str(bound)
+                le_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_format_labels(key, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(name, help_text)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets=LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], Dict[Labels, float]]) -> Gauge:
+        metric = Gauge(name, help_text, read)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_seconds = registry.histogram("bot_handler_seconds", "Время работы обработчика")
+handler_errors = registry.counter("bot_handler_errors_total", "Исключения в обработчиках")
+query_seconds = registry.histogram("db_query_seconds", "Время запроса к БД по имени запроса")
+query_errors = registry.counter("db_query_errors_total", "Ошибки запросов к БД")
+pool_acquire_seconds = registry.histogram("db_pool_acquire_seconds", "Ожидание соединения из пула")
+
+_pools: Dict[str, object] = {}
+
+
+def _read_pools() -> Dict[Labels, float]:
+    values = {}
+    for name, pool in _pools.items():
+        values[_labels({"pool": name, "state": "open"})] = pool.get_size()
+        values[_labels({"pool": name, "state": "idle"})] = pool.get_idle_size()
+        values[_labels({"pool": name, "state": "max"})] = pool.get_max_size()
+    return values
+
+
+registry.gauge("db_pool_connections", "Соединений в пуле: открыто, свободно, максимум", _read_pools)
+
+
+async def handler_metrics_middleware(handler, event, data):
+    """Middleware aiogram: время и ошибки по имени функции-обработчика."""
+    name = data["handler"].callback.__name__
+    start = time.perf_counter()
+    try:
+        return await handler(event, data)
+    except Exception:
+        handler_errors.inc(handler=name)
+        raise
+    finally:
+        handler_seconds.observe(time.perf_counter() - start, handler=name)
+
+
+class _InstrumentedConnection:
+    TIMED = {"fetch", "fetchrow", "fetchval", "execute", "executemany", "copy_records_to_table"}
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name not in self.TIMED:
+            return attr
+
+        def timed(*args, **kwargs):
+            # Имя запроса — метод Database, из которого он вызван
+            return self._timed(sys._getframe(1).f_code.co_name, attr, args, kwargs)
+        return timed
+
+    @staticmethod
+    async def _timed(statement: str, attr, args, kwargs):
+        start = time.perf_counter()
+        try:
+            return await attr(*args, **kwargs)
+        except Exception:
+            query_errors.inc(statement=statement)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            query_seconds.observe(elapsed, statement=statement)
+            if DB_SLOW_QUERY_MS and elapsed * 1000 >= DB_SLOW_QUERY_MS:
+                logger.warning(f"Медленный запрос {statement}: {elapsed * 1000:.1f} мс")
+
+
+class InstrumentedPool:
+    """Обёртка над asyncpg.Pool: время ожидания соединения и время каждого запроса."""
+
+    def __init__(self, pool, name: str = "primary"):
+        self._pool = pool
+        self.name = name
+        _pools[name] = pool
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    @asynccontextmanager
+    async def acquire(self, *args, **kwargs):
+        start = time.perf_counter()
+        async with self._pool.acquire(*args, **kwargs) as conn:
+            pool_acquire_seconds.observe(time.perf_counter() - start, pool=self.name)
+            yield _InstrumentedConnection(conn)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+
+def add_routes(app: web.Application):
+    app.router.add_get("/metrics", handle_metrics)
+
+
+async def start_metrics_server(port: int = METRICS_PORT) -> Optional[web.AppRunner]:
+    if not port:
+        return None
+    app = web.Application()
+    add_routes(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    logger.info(f"Метрики доступны на :{port}/metrics")
+    return runner
+
+
+def format_stats() -> str:
+    """Короткая сводка для команды /stats."""
+    lines = ["📊 Обработчики (вызовов, p50/p95, ошибок):"]
+    for key, (_, _, count) in sorted(handler_seconds.values.items(), key=lambda kv: -kv[1][2]):
+        name = dict(key)["handler"]
+        p50 = handler_seconds.quantile(0.5, handler=name) * 1000
+        p95 = handler_seconds.quantile(0.95, handler=name) * 1000
+        errors = int(handler_errors.values.get(key, 0))
+        lines.append(f"• {name}: {count}, ≤{p50:g}/≤{p95:g} мс, {errors}")
+
+    lines.append("\n🗄 Запросы к БД (вызовов, среднее):")
+    top = sorted(query_seconds.values.items(), key=lambda kv: -kv[1][1])[:10]
+    for key, (_, total, count) in top:
+        lines.append(f"• {dict(key)['statement']}: {count}, {total / count * 1000:.1f} мс")
+
+    for key, (_, total, count) in pool_acquire_seconds.values.items():
+        pool = dict(key)["pool"]
+        p95 = pool_acquire_seconds.quantile(0.95, pool=pool) * 1000
+        lines.append(f"\n⏳ Ожидание пула {pool}: в среднем {total / count * 1000:.2f} мс, p95 ≤{p95:g} мс")
+    return "\n".join(lines)
@@ -0,0 +1,126 @@
+-- Исходная схема (то, что раньше создавал Database.create_tables).
+-- Везде IF NOT EXISTS / OR REPLACE: на уже работающих базах миграция ничего не меняет.
+
+-- Таблица категорий
+CREATE TABLE IF NOT EXISTS categories (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL UNIQUE,
+    order_index INTEGER DEFAULT 0
+);
+
+-- Таблица товаров
+CREATE TABLE IF NOT EXISTS products (
+    id SERIAL PRIMARY KEY,
+    category_id INTEGER REFERENCES categories(id) ON DELETE CASCADE,
+    name VARCHAR(500) NOT NULL,
+    weight VARCHAR(100),
+    price INTEGER NOT NULL,
+    order_index INTEGER DEFAULT 0
+);
+
+-- Таблица пользователей
+CREATE TABLE IF NOT EXISTS users (
+    id BIGINT PRIMARY KEY,
+    username VARCHAR(255),
+    first_name VARCHAR(255),
+    phone VARCHAR(50),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+-- Колонка phone появилась позже первых установок
+ALTER TABLE users ADD COLUMN IF NOT EXISTS phone VARCHAR(50);
+
+-- Таблица корзин
+CREATE TABLE IF NOT EXISTS carts (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(user_id)
+);
+
+-- Таблица позиций в корзине
+CREATE TABLE IF NOT EXISTS cart_items (
+    id SERIAL PRIMARY KEY,
+    cart_id INTEGER NOT NULL REFERENCES carts(id) ON DELETE CASCADE,
+    product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    quantity INTEGER NOT NULL DEFAULT 1,
+    UNIQUE(cart_id, product_id)
+);
+
+-- Таблица заказов
+CREATE TABLE IF NOT EXISTS orders (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    total_price INTEGER NOT NULL,
+    status VARCHAR(50) DEFAULT 'pending',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Таблица позиций в заказе
+CREATE TABLE IF NOT EXISTS order_items (
+    id SERIAL PRIMARY KEY,
+    order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+    product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    quantity INTEGER NOT NULL,
+    price INTEGER NOT NULL
+);
+
+-- Исходящие уведомления о заказах (outbox): пишутся в транзакции заказа,
+-- отправляются фоновой задачей
+CREATE TABLE IF NOT EXISTS order_notifications (
+    id BIGSERIAL PRIMARY KEY,
+    order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+    chat_id BIGINT NOT NULL,
+    text TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    sent_at TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS order_notifications_pending_idx
+ON order_notifications (next_attempt_at) WHERE status = 'pending';
+
+-- Версия каталога: увеличивается триггером при любом изменении
+-- categories/products, об изменении рассылается NOTIFY catalog_changed
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO catalog_version (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+DECLARE
+    new_version BIGINT;
+BEGIN
+    UPDATE catalog_version SET version = version + 1 RETURNING version INTO new_version;
+    PERFORM pg_notify('catalog_changed', new_version::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER categories_catalog_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON categories
+FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+
+CREATE OR REPLACE TRIGGER products_catalog_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON products
+FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+
+-- Состояния сценариев пользователей (FSM), общие для всех процессов бота.
+-- UNLOGGED: это временные данные, WAL для них не нужен
+CREATE UNLOGGED TABLE IF NOT EXISTS flow_state (
+    key VARCHAR(255) PRIMARY KEY,
+    value JSONB NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+-- Кэш file_id загруженных в Telegram файлов
+CREATE TABLE IF NOT EXISTS media_files (
+    path VARCHAR(500) NOT NULL,
+    content_hash VARCHAR(64) NOT NULL,
+    variant VARCHAR(20) NOT NULL DEFAULT 'original',
+    file_id VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (path, content_hash, variant)
+);
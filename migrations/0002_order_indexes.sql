@@ -0,0 +1,8 @@
+-- История заказов пользователя и выборки «последние заказы»
+CREATE INDEX IF NOT EXISTS orders_user_created_idx ON orders (user_id, created_at);
+
+-- Состав заказа: чтение по order_id и каскадное удаление вместе с заказом
+CREATE INDEX IF NOT EXISTS order_items_order_idx ON order_items (order_id);
+
+-- Outbox удаляется каскадом вместе с заказом
+CREATE INDEX IF NOT EXISTS order_notifications_order_idx ON order_notifications (order_id);
@@ -0,0 +1,6 @@
+-- Импорт каталога не удаляет строки (на товары ссылаются заказы), а снимает их с показа
+ALTER TABLE categories ADD COLUMN IF NOT EXISTS is_active BOOLEAN NOT NULL DEFAULT TRUE;
+ALTER TABLE products ADD COLUMN IF NOT EXISTS is_active BOOLEAN NOT NULL DEFAULT TRUE;
+
+-- Сопоставление товаров при импорте идёт по (категория, название)
+CREATE INDEX IF NOT EXISTS products_category_name_idx ON products (category_id, name);
@@ -0,0 +1,6 @@
+-- «Мои заказы»: страницы по ключу (created_at, id) от новых к старым,
+-- без OFFSET. Индекс покрывает и фильтр по пользователю, и сортировку.
+CREATE INDEX IF NOT EXISTS orders_user_history_idx ON orders (user_id, created_at DESC, id DESC);
+
+-- Прежний индекс (user_id, created_at) новым полностью перекрыт
+DROP INDEX IF EXISTS orders_user_created_idx;
@@ -0,0 +1,21 @@
+-- Продажи по товарам за день для /report. Пополняется в транзакции
+-- оформления заказа, поэтому отчёт не сканирует order_items.
+CREATE TABLE IF NOT EXISTS daily_product_sales (
+    day DATE NOT NULL,
+    product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    quantity INTEGER NOT NULL DEFAULT 0,
+    revenue BIGINT NOT NULL DEFAULT 0,
+    orders INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, product_id)
+);
+
+-- Заказы, оформленные до появления таблицы
+INSERT INTO daily_product_sales (day, product_id, quantity, revenue, orders)
+SELECT o.created_at::date, oi.product_id, SUM(oi.quantity), SUM(oi.quantity * oi.price), COUNT(DISTINCT o.id)
+FROM orders o
+JOIN order_items oi ON oi.order_id = o.id
+GROUP BY o.created_at::date, oi.product_id
+ON CONFLICT (day, product_id) DO NOTHING;
+
+-- Выгрузка заказов за период по всем пользователям
+CREATE INDEX IF NOT EXISTS orders_created_idx ON orders (created_at);
@@ -0,0 +1,47 @@
+-- Вместимость кухни. Сколько ещё можно продать товара в день и сколько
+-- ещё заказов принять за день; нет строки — нет ограничения. Оформление
+-- заказа резервирует условным UPDATE ... WHERE remaining >= n, отмена возвращает.
+CREATE TABLE IF NOT EXISTS product_capacity (
+    day DATE NOT NULL,
+    product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    remaining INTEGER NOT NULL CHECK (remaining >= 0),
+    PRIMARY KEY (day, product_id)
+);
+
+CREATE TABLE IF NOT EXISTS day_capacity (
+    day DATE PRIMARY KEY,
+    remaining INTEGER NOT NULL CHECK (remaining >= 0)
+);
+
+-- Процессы бота держат остатки на сегодня в памяти и перечитывают их по NOTIFY
+-- с датой в payload. Триггер построчный: резервирование, которое не задело
+-- ни одной строки (у заказа нет ограничений), уведомлений не рассылает, а
+-- одинаковые NOTIFY в одной транзакции PostgreSQL доставляет один раз.
+CREATE OR REPLACE FUNCTION notify_capacity_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        PERFORM pg_notify('capacity_changed', '');
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('capacity_changed', OLD.day::text);
+    ELSE
+        PERFORM pg_notify('capacity_changed', NEW.day::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER product_capacity_changed
+AFTER INSERT OR UPDATE OR DELETE ON product_capacity
+FOR EACH ROW EXECUTE FUNCTION notify_capacity_changed();
+
+CREATE OR REPLACE TRIGGER product_capacity_truncated
+AFTER TRUNCATE ON product_capacity
+FOR EACH STATEMENT EXECUTE FUNCTION notify_capacity_changed();
+
+CREATE OR REPLACE TRIGGER day_capacity_changed
+AFTER INSERT OR UPDATE OR DELETE ON day_capacity
+FOR EACH ROW EXECUTE FUNCTION notify_capacity_changed();
+
+CREATE OR REPLACE TRIGGER day_capacity_truncated
+AFTER TRUNCATE ON day_capacity
+FOR EACH STATEMENT EXECUTE FUNCTION notify_capacity_changed();
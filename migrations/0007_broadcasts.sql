@@ -0,0 +1,26 @@
+-- Пользователь заблокировал бота (или удалил аккаунт): рассылки его пропускают
+ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMPTZ;
+
+-- Рассылки администраторов. Получатели перебираются по возрастанию users.id,
+-- last_user_id — последний обработанный: после перезапуска рассылка
+-- продолжается с него. lease_until не даёт двум процессам вести одну рассылку.
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id BIGSERIAL PRIMARY KEY,
+    text TEXT,
+    source_chat_id BIGINT,
+    source_message_id BIGINT,
+    admin_chat_id BIGINT NOT NULL,
+    progress_message_id BIGINT,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    total INTEGER NOT NULL DEFAULT 0,
+    last_user_id BIGINT NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    lease_until TIMESTAMPTZ,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS broadcasts_running_idx ON broadcasts (id) WHERE status = 'running';
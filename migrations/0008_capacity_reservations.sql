@@ -0,0 +1,13 @@
+-- Что именно заказ списал с вместимости: строка на каждый товар с ограничением
+-- и строка с product_id IS NULL за место в заказах дня. Отмена возвращает
+-- только записанное здесь, поэтому заказ, оформленный без ограничений или до
+-- их появления, при отмене остатки не раздувает. Заказы до этой миграции
+-- записей не имеют и при отмене ничего не возвращают.
+CREATE TABLE IF NOT EXISTS capacity_reservations (
+    order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    product_id INTEGER REFERENCES products(id) ON DELETE CASCADE,
+    quantity INTEGER NOT NULL CHECK (quantity > 0)
+);
+
+CREATE INDEX IF NOT EXISTS idx_capacity_reservations_order ON capacity_reservations (order_id);
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from outbound import LANE_BACKGROUND, outbound_lane
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_BATCH = int(os.getenv("NOTIFY_BATCH", "50"))
+NOTIFY_POLL_INTERVAL = float(os.getenv("NOTIFY_POLL_INTERVAL", "5"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "10"))
+# Пока уведомление отправляется, другие процессы его не берут; после падения — возьмут
+NOTIFY_LEASE = int(os.getenv("NOTIFY_LEASE", "60"))
+
+
+class NotificationDispatcher:
+    """Фоновая отправка уведомлений из таблицы order_notifications.
+
+    Записи создаются в транзакции заказа, поэтому не теряются при падении
+    бота. Отправка идёт параллельно в фоновой полосе OutboundScheduler
+    (лимиты, retry_after), неудачные попытки повторяются с нарастающей паузой.
+    """
+
+    def __init__(self, db, bot: Bot):
+        self.db = db
+        self.bot = bot
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def wake(self):
+        """Есть новые уведомления — не ждём очередного опроса."""
+        self._wake.set()
+
+    async def _run(self):
+        # Уведомления админам уступают очередь ответам пользователям
+        outbound_lane.set(LANE_BACKGROUND)
+        while True:
+            try:
+                sent = await self.dispatch_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка рассылки уведомлений: {e}")
+                sent = 0
+            if sent < NOTIFY_BATCH:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=NOTIFY_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    async def dispatch_once(self) -> int:
+        batch = await self.db.claim_notifications(NOTIFY_BATCH, NOTIFY_LEASE)
+        if batch:
+            await asyncio.gather(*(self._send(item) for item in batch))
+        return len(batch)
+
+    async def _send(self, item: dict):
+        chat_id = item["chat_id"]
+        try:
+            await self.bot.send_message(chat_id, item["text"])
+        except TelegramRetryAfter as e:
+            # OutboundScheduler уже повторял; откладываем уведомление целиком
+            logger.warning(f"Флуд-лимит для чата {chat_id}, повтор через {e.retry_after} с")
+            await self.db.reschedule_notification(item["id"], e.retry_after, str(e), give_up=False)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Бот заблокирован или чата нет — повторять бессмысленно
+            logger.error(f"Не удалось отправить уведомление {item['id']} в чат {chat_id}: {e}")
+            await self.db.reschedule_notification(item["id"], 0, str(e), give_up=True)
+        except Exception as e:
+            delay = min(600, 2 ** item["attempts"])
+            give_up = item["attempts"] >= NOTIFY_MAX_ATTEMPTS
+            logger.error(f"Не удалось отправить уведомление {item['id']} в чат {chat_id}: {e}")
+            await self.db.reschedule_notification(item["id"], delay, str(e), give_up=give_up)
+        else:
+            await self.db.mark_notification_sent(item["id"])
+            logger.info(f"Уведомление по заказу #{item['order_id']} отправлено в чат {chat_id}")
@@ -0,0 +1,132 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, AnswerInlineQuery
+
+import metrics
+from ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз повторять запрос после 429 и какой retry_after ещё готовы ждать, секунды
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+OUTBOUND_MAX_RETRY_AFTER = float(os.getenv("OUTBOUND_MAX_RETRY_AFTER", "60"))
+
+# Полосы по убыванию приоритета. Ответы на callback и inline-запросы
+# в очередь не встают вовсе: пользователь ждёт их с часиками на кнопке.
+LANE_INTERACTIVE = 1  # правки и сообщения в ответ пользователю
+LANE_BACKGROUND = 2  # уведомления админам, рассылки
+LANE_NAMES = {LANE_INTERACTIVE: "interactive", LANE_BACKGROUND: "background"}
+
+# Полоса текущей задачи; фоновые задачи выставляют LANE_BACKGROUND при старте
+outbound_lane: contextvars.ContextVar[int] = contextvars.ContextVar("outbound_lane", default=LANE_INTERACTIVE)
+
+outbound_throttle_seconds = metrics.registry.histogram(
+    "bot_outbound_throttle_seconds", "Ожидание лимитов Bot API перед отправкой"
+)
+outbound_retries = metrics.registry.counter("bot_outbound_retries_total", "Повторы после 429 retry_after")
+
+IMMEDIATE = (AnswerCallbackQuery, AnswerInlineQuery)
+
+
+def _kind(method) -> Optional[str]:
+    """'send' — новое сообщение (лимит чата и общий), 'edit' — правка (общий), None — без лимитов."""
+    name = type(method).__name__
+    if name.startswith(("Send", "Copy", "Forward")):
+        return "send"
+    if name.startswith("Edit"):
+        return "edit"
+    return None
+
+
+class OutboundScheduler:
+    """Request-middleware сессии Bot: все исходящие запросы проходят через лимиты.
+
+    Новые сообщения сначала ждут лимит своего чата, затем вместе с правками
+    встают в общую очередь по полосам: слот общего лимита достаётся самому
+    приоритетному ожидающему запросу. На 429 запрос сам повторяется после
+    retry_after: на паузу ставится чат запроса (и для правок), весь бот —
+    только если чата у запроса нет (правка inline-сообщения). Служебные методы
+    (getUpdates, setWebhook и т.п.) и ответы на callback идут без очереди.
+    """
+
+    def __init__(self, limiter: Optional[RateLimiter] = None):
+        self.limiter = limiter or RateLimiter()
+        self._heap: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        metrics.registry.gauge("bot_outbound_queue", "Запросы к Bot API в очереди по полосам", self._read_queue)
+
+    def _read_queue(self):
+        depth = {lane: 0 for lane in LANE_NAMES}
+        for lane, _, future in self._heap:
+            if not future.done():
+                depth[lane] += 1
+        return {(("lane", LANE_NAMES[lane]),): value for lane, value in depth.items()}
+
+    async def __call__(self, make_request, bot, method):
+        kind = None if isinstance(method, IMMEDIATE) else _kind(method)
+        if kind is None:
+            return await make_request(bot, method)
+
+        lane = outbound_lane.get()
+        # У правок тоже есть чат: 429 на правку ставит на паузу только его, а не весь бот
+        chat_id = getattr(method, "chat_id", None)
+        for attempt in range(OUTBOUND_MAX_RETRIES + 1):
+            start = time.monotonic()
+            if isinstance(chat_id, int):
+                if kind == "send":
+                    await self.limiter.acquire_chat(chat_id)
+                else:
+                    await self.limiter.wait_chat_pause(chat_id)
+            await self._acquire(lane)
+            outbound_throttle_seconds.observe(time.monotonic() - start, lane=LANE_NAMES[lane])
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= OUTBOUND_MAX_RETRIES or e.retry_after > OUTBOUND_MAX_RETRY_AFTER:
+                    raise
+                outbound_retries.inc(method=type(method).__name__)
+                logger.warning(f"429 на {type(method).__name__}, повтор через {e.retry_after} с")
+                if isinstance(chat_id, int):
+                    self.limiter.retry_after(chat_id, e.retry_after)
+                else:
+                    self.limiter.pause_all(e.retry_after)
+
+    async def _acquire(self, lane: int):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch())
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (lane, next(self._seq), future))
+        self._ready.set()
+        await future
+
+    async def _dispatch(self):
+        """Раздаёт слоты общего лимита: каждый — самому приоритетному из ожидающих."""
+        bucket = self.limiter.global_bucket
+        while True:
+            await self._ready.wait()
+            wait = bucket.reserve(time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+            # Берём из очереди после ожидания: за это время мог прийти запрос важнее
+            while self._heap:
+                _, _, future = heapq.heappop(self._heap)
+                if not future.done():
+                    future.set_result(None)
+                    break
+            if not self._heap:
+                self._ready.clear()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
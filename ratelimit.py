@@ -0,0 +1,71 @@
+import asyncio
+import os
+import time
+from typing import Dict
+
+# Лимиты Telegram: около 30 сообщений в секунду всего и 1 в секунду в один чат
+GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+
+
+class TokenBucket:
+    """Ведро токенов в форме GCRA: хранит только время следующего свободного слота."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.interval = 1 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.tat = 0.0  # theoretical arrival time
+        self.paused_until = 0.0
+
+    def reserve(self, now: float) -> float:
+        """Занимает слот и возвращает, сколько секунд до него ждать."""
+        tat = max(self.tat, now, self.paused_until)
+        self.tat = tat + self.interval
+        return max(0.0, tat - self.tolerance - now, self.paused_until - now)
+
+    def pause(self, until: float):
+        self.paused_until = max(self.paused_until, until)
+
+    def idle(self, now: float) -> bool:
+        return self.tat <= now and self.paused_until <= now
+
+
+class RateLimiter:
+    """Общий лимит на все отправки плюс отдельный лимит на каждый чат."""
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE, burst: int = 3):
+        self.global_bucket = TokenBucket(global_rate, burst=max(1, int(global_rate)))
+        self.chat_rate = chat_rate
+        self.burst = burst
+        self._chats: Dict[int, TokenBucket] = {}
+
+    def _chat(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                now = time.monotonic()
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, burst=self.burst)
+        return bucket
+
+    async def acquire_chat(self, chat_id: int) -> float:
+        """Ждёт только лимит чата; общий лимит раздаёт очередь в outbound.py."""
+        wait = self._chat(chat_id).reserve(time.monotonic())
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    async def wait_chat_pause(self, chat_id: int) -> float:
+        """Для правок: лимит новых сообщений их не касается, но пауза чата после 429 — да."""
+        bucket = self._chats.get(chat_id)
+        wait = bucket.paused_until - time.monotonic() if bucket else 0.0
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return max(wait, 0.0)
+
+    def retry_after(self, chat_id: int, seconds: float):
+        """Telegram вернул 429 с retry_after: ставим чат на паузу."""
+        self._chat(chat_id).pause(time.monotonic() + seconds)
+
+    def pause_all(self, seconds: float):
+        self.global_bucket.pause(time.monotonic() + seconds)
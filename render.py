@@ -0,0 +1,63 @@
+import hashlib
+import logging
+
+from aiogram.exceptions import TelegramBadRequest
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+renders_skipped = metrics.registry.counter("bot_renders_skipped_total", "Правки сообщений, не отправленные: содержимое не изменилось")
+
+# Ответы Bot API, после которых сообщение править бесполезно — отправляем новое
+UNEDITABLE = (
+    "message can't be edited",
+    "message to edit not found",
+    "there is no text in the message to edit",
+    "there is no caption in the message to edit",
+    "there is no media in the message to edit",
+    "message_id_invalid",
+)
+
+NOT_MODIFIED = "message is not modified"
+
+
+def classify_edit_error(error: TelegramBadRequest) -> str:
+    """'not_modified' — содержимое то же; 'uneditable' — нужно новое сообщение; 'other' — настоящая ошибка."""
+    text = str(error.message).lower()
+    if NOT_MODIFIED in text:
+        return "not_modified"
+    if any(reason in text for reason in UNEDITABLE):
+        return "uneditable"
+    return "other"
+
+
+def render_key(kind: str, content: str, reply_markup=None) -> str:
+    """Хеш отрисовки: тип сообщения, текст (или подпись) и клавиатура."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(kind.encode())
+    h.update(b"\0")
+    h.update(content.encode())
+    h.update(b"\0")
+    if reply_markup is not None:
+        h.update(reply_markup.model_dump_json(exclude_none=True).encode())
+    return h.hexdigest()
+
+
+def is_current(message, render: str) -> bool:
+    """Сообщение уже показывает эту отрисовку — правку можно не отправлять.
+
+    Сверяемся с содержимым сообщения из самого обновления, а не с памятью
+    процесса: при webhook с несколькими репликами обновления пользователя
+    приходят в разные процессы, и чужая правка была бы им не видна.
+    """
+    if message.photo:
+        shown = render_key("photo", message.caption or "", message.reply_markup)
+    elif message.text is not None:
+        shown = render_key("text", message.text, message.reply_markup)
+    else:
+        return False
+    if shown != render:
+        return False
+    renders_skipped.inc()
+    return True
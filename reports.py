@@ -0,0 +1,112 @@
+import csv
+import logging
+import os
+from datetime import date, datetime
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк читать из курсора за раз при выгрузке заказов
+REPORT_EXPORT_CHUNK = int(os.getenv("REPORT_EXPORT_CHUNK", "1000"))
+# Ограничение Telegram на длину сообщения
+MESSAGE_LIMIT = 4096
+
+ORDERS_CSV_FIELDS = ("order_id", "created_at", "user_id", "phone", "status", "product", "quantity", "price", "amount")
+
+DATE_FORMATS = ("%d.%m.%Y", "%Y-%m-%d")
+
+
+def parse_date(text: str) -> date:
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Не понял дату «{text}», нужен формат ДД.ММ.ГГГГ")
+
+
+def parse_period(args: str) -> Tuple[date, date]:
+    """Аргументы команды: пусто — сегодня, одна дата — этот день, две — период включительно."""
+    parts = args.split()
+    if not parts:
+        today = date.today()
+        return today, today
+    if len(parts) > 2:
+        raise ValueError("Укажите одну дату или две: ДД.ММ.ГГГГ ДД.ММ.ГГГГ")
+    date_from = parse_date(parts[0])
+    date_to = parse_date(parts[-1])
+    if date_to < date_from:
+        date_from, date_to = date_to, date_from
+    return date_from, date_to
+
+
+def format_period(date_from: date, date_to: date) -> str:
+    if date_from == date_to:
+        return f"{date_from:%d.%m.%Y}"
+    return f"{date_from:%d.%m.%Y}–{date_to:%d.%m.%Y}"
+
+
+def split_message(lines: List[str], limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Склеивает строки в сообщения не длиннее limit, не разрывая строк."""
+    messages, current = [], ""
+    for line in lines:
+        if current and len(current) + len(line) + 1 > limit:
+            messages.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+
+def format_sales_report(rows: List[Dict], date_from: date, date_to: date) -> List[str]:
+    """Сводка для /report: по каждому дню товары с количеством и выручкой, затем итог периода."""
+    title = f"📈 Продажи за {format_period(date_from, date_to)}"
+    if not rows:
+        return [f"{title}\n\nЗаказов нет."]
+
+    lines = [title]
+    totals: Dict[str, List[int]] = {}
+    day = None
+    day_revenue = 0
+    for row in rows:
+        if row["day"] != day:
+            if day is not None:
+                lines.append(f"Итого за день: {day_revenue}₽")
+            day = row["day"]
+            day_revenue = 0
+            lines.append(f"\n📅 {day:%d.%m.%Y}")
+        lines.append(f"• {row['name']}: {row['quantity']} шт. — {row['revenue']}₽")
+        day_revenue += row["revenue"]
+        total = totals.setdefault(row["name"], [0, 0])
+        total[0] += row["quantity"]
+        total[1] += row["revenue"]
+    lines.append(f"Итого за день: {day_revenue}₽")
+
+    if date_from != date_to:
+        # Для производства важнее всего общее количество каждого товара за период
+        lines.append("\n🧾 За весь период:")
+        for name, (quantity, revenue) in sorted(totals.items(), key=lambda kv: -kv[1][0]):
+            lines.append(f"• {name}: {quantity} шт. — {revenue}₽")
+        lines.append(f"Итого: {sum(revenue for _, revenue in totals.values())}₽")
+    return split_message(lines)
+
+
+async def export_orders_csv(db, date_from: date, date_to: date, path: str,
+                            chunk_size: int = REPORT_EXPORT_CHUNK) -> int:
+    """Пишет позиции заказов за период в CSV по мере чтения из курсора; возвращает число строк."""
+    count = 0
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(ORDERS_CSV_FIELDS)
+        async for rows in db.iter_order_lines(date_from, date_to, chunk_size):
+            writer.writerows(
+                (
+                    row["order_id"], f"{row['created_at']:%Y-%m-%d %H:%M:%S}", row["user_id"], row["phone"] or "",
+                    row["status"], row["product"], row["quantity"], row["price"], row["quantity"] * row["price"],
+                )
+                for row in rows
+            )
+            count += len(rows)
+    logger.info(f"Выгрузка заказов за {format_period(date_from, date_to)}: {count} строк")
+    return count
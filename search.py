@@ -0,0 +1,112 @@
+import bisect
+import itertools
+import logging
+import os
+import re
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+SEARCH_RESULTS_LIMIT = int(os.getenv("SEARCH_RESULTS_LIMIT", "20"))
+# Сходство по триграммам (как pg_trgm.similarity_threshold), при котором слово считается найденным с опечаткой
+SEARCH_TRIGRAM_THRESHOLD = float(os.getenv("SEARCH_TRIGRAM_THRESHOLD", "0.3"))
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    return text.lower().replace("ё", "е")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def trigrams(token: str) -> Set[str]:
+    # Как в pg_trgm: слово дополняется пробелами, чтобы начало слова весило больше
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Поиск товаров по названию для inline-режима, целиком в памяти.
+
+    Названия приводятся к нижнему регистру, ё заменяется на е. Слово запроса
+    ищется как префикс слов названия (бинарным поиском по отсортированному
+    словарю), а если префикс не нашёлся — по триграммам, чтобы прощать опечатки.
+    Индекс перестраивается при каждой перезагрузке каталога.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._order: Dict[int, int] = {}  # product_id -> позиция в меню, для стабильной сортировки
+        self._words: List[str] = []
+        self._word_products: Dict[str, Set[int]] = {}
+        self._trigram_words: Dict[str, Set[str]] = {}
+        catalog.subscribe(self.rebuild)
+
+    def rebuild(self, version: int = None):
+        order = {}
+        word_products: Dict[str, Set[int]] = defaultdict(set)
+        for category in self.catalog.categories():
+            for product in self.catalog.products(category["id"]):
+                order[product["id"]] = len(order)
+                for word in tokenize(product["name"]):
+                    word_products[word].add(product["id"])
+
+        trigram_words: Dict[str, Set[str]] = defaultdict(set)
+        for word in word_products:
+            for trigram in trigrams(word):
+                trigram_words[trigram].add(word)
+
+        self._order = order
+        self._words = sorted(word_products)
+        self._word_products = dict(word_products)
+        self._trigram_words = dict(trigram_words)
+        logger.info(f"Поисковый индекс: {len(order)} товаров, {len(self._words)} слов")
+
+    def _prefix_words(self, token: str) -> List[str]:
+        start = bisect.bisect_left(self._words, token)
+        end = bisect.bisect_left(self._words, token + "\uffff")
+        return self._words[start:end]
+
+    def _similar_words(self, token: str) -> List[Tuple[str, float]]:
+        token_trigrams = trigrams(token)
+        hits: Dict[str, int] = defaultdict(int)
+        for trigram in token_trigrams:
+            for word in self._trigram_words.get(trigram, ()):
+                hits[word] += 1
+        similar = []
+        for word, count in hits.items():
+            # Сходство как в pg_trgm: общие триграммы к объединению
+            similarity = count / (len(token_trigrams) + len(trigrams(word)) - count)
+            if similarity >= SEARCH_TRIGRAM_THRESHOLD:
+                similar.append((word, similarity))
+        return similar
+
+    def search(self, query: str, limit: int = SEARCH_RESULTS_LIMIT, offset: int = 0) -> List[int]:
+        """id товаров по убыванию релевантности; пустой запрос — товары в порядке меню."""
+        tokens = tokenize(query)
+        if not tokens:
+            return list(itertools.islice(self._order, offset, offset + limit))
+
+        scores: Dict[int, float] = defaultdict(float)
+        matched: Dict[int, int] = defaultdict(int)
+        for token in tokens:
+            found: Dict[int, float] = {}
+            for word in self._prefix_words(token):
+                for product_id in self._word_products[word]:
+                    # Полное совпадение слова ценнее префикса
+                    found[product_id] = max(found.get(product_id, 0), 2.0 if word == token else 1.5)
+            if not found and len(token) >= 3:
+                for word, similarity in self._similar_words(token):
+                    for product_id in self._word_products[word]:
+                        found[product_id] = max(found.get(product_id, 0), similarity)
+            for product_id, score in found.items():
+                scores[product_id] += score
+                matched[product_id] += 1
+
+        # Сначала товары, где нашлись все слова запроса, затем по очкам и порядку в меню
+        ranked = sorted(scores, key=lambda pid: (-matched[pid], -scores[pid], self._order.get(pid, 0)))
+        return ranked[offset:offset + limit]
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+# memory — в памяти процесса, postgres — общая для всех реплик UNLOGGED-таблица
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").strip().lower()
+# Сколько живёт состояние пользователя без обращений, секунды
+STATE_TTL = int(os.getenv("STATE_TTL", str(24 * 3600)))
+STATE_SWEEP_INTERVAL = float(os.getenv("STATE_SWEEP_INTERVAL", "300"))
+
+
+class StateStore(ABC):
+    """Хранилище состояний сценариев (ключ -> JSON-словарь) с истечением по TTL."""
+
+    def __init__(self, ttl: int = STATE_TTL):
+        self.ttl = ttl
+        self._task: Optional[asyncio.Task] = None
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: Dict[str, Any]):
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    async def purge_expired(self) -> int:
+        """Удаляет просроченные записи, возвращает их количество."""
+
+    async def start(self):
+        self._task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(STATE_SWEEP_INTERVAL)
+            try:
+                removed = await self.purge_expired()
+                if removed:
+                    logger.info(f"Удалено просроченных состояний: {removed}")
+            except Exception as e:
+                logger.error(f"Ошибка очистки состояний: {e}")
+
+
+class MemoryStateStore(StateStore):
+    def __init__(self, ttl: int = STATE_TTL):
+        super().__init__(ttl)
+        self._items: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        now = time.monotonic()
+        if item[0] < now:
+            del self._items[key]
+            return None
+        # Обращение продлевает жизнь: идущий сценарий не истечёт посреди оформления
+        self._items[key] = (now + self.ttl, item[1])
+        return item[1]
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        self._items[key] = (time.monotonic() + self.ttl, value)
+
+    async def delete(self, key: str):
+        self._items.pop(key, None)
+
+    async def purge_expired(self) -> int:
+        now = time.monotonic()
+        expired = [key for key, (expires_at, _) in self._items.items() if expires_at < now]
+        for key in expired:
+            del self._items[key]
+        return len(expired)
+
+
+class PostgresStateStore(StateStore):
+    """Состояния в UNLOGGED-таблице flow_state: видны всем процессам бота."""
+
+    def __init__(self, db, ttl: int = STATE_TTL):
+        super().__init__(ttl)
+        self.db = db
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = await self.db.get_flow_state(key, self.ttl)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        await self.db.set_flow_state(key, json.dumps(value, ensure_ascii=False), self.ttl)
+
+    async def delete(self, key: str):
+        await self.db.delete_flow_state(key)
+
+    async def purge_expired(self) -> int:
+        return await self.db.purge_flow_state()
+
+
+class StateStoreStorage(BaseStorage):
+    """FSM-хранилище aiogram поверх StateStore."""
+
+    def __init__(self, store: StateStore):
+        self.store = store
+
+    @staticmethod
+    def _key(key: StorageKey, part: str) -> str:
+        thread = f":{key.thread_id}" if key.thread_id else ""
+        return f"fsm:{key.bot_id}:{key.chat_id}:{key.user_id}{thread}:{key.destiny}:{part}"
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        if state is None:
+            await self.store.delete(self._key(key, "state"))
+            return
+        value = state.state if isinstance(state, State) else state
+        await self.store.set(self._key(key, "state"), {"state": value})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        item = await self.store.get(self._key(key, "state"))
+        return item["state"] if item else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        if not data:
+            await self.store.delete(self._key(key, "data"))
+            return
+        await self.store.set(self._key(key, "data"), data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict(await self.store.get(self._key(key, "data")) or {})
+
+    async def close(self) -> None:
+        await self.store.stop()
+
+
+def build_state_store(db) -> StateStore:
+    if STATE_BACKEND == "postgres":
+        return PostgresStateStore(db)
+    if STATE_BACKEND != "memory":
+        logger.warning(f"Неизвестный STATE_BACKEND={STATE_BACKEND}, используем memory")
+    return MemoryStateStore()
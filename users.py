@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+# Как часто сбрасывать накопленные изменения имён, секунды
+USER_FLUSH_INTERVAL = float(os.getenv("USER_FLUSH_INTERVAL", "2"))
+USER_FLUSH_BATCH = int(os.getenv("USER_FLUSH_BATCH", "500"))
+
+Profile = Tuple[Optional[str], Optional[str]]
+
+
+class UserRegistry:
+    """Помнит, каких пользователей (и с какими именами) мы уже записали в users.
+
+    Повторное нажатие кнопки тем же пользователем не трогает БД. Новый
+    пользователь записывается сразу (на него ссылаются carts и orders),
+    а смена username/first_name у известного копится и пишется пачкой.
+    """
+
+    def __init__(self, db, capacity: int = USER_CACHE_SIZE):
+        self.db = db
+        self.capacity = capacity
+        self._seen: "OrderedDict[int, Profile]" = OrderedDict()
+        self._pending: Dict[int, Profile] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        try:
+            await self.flush()
+        except Exception:
+            # Ошибка уже в логе; имена — не критичные данные, остальная остановка важнее
+            pass
+
+    async def ensure(self, user_id: int, username: Optional[str], first_name: Optional[str]):
+        profile = (username, first_name)
+        known = self._seen.get(user_id)
+        if known is not None:
+            self._seen.move_to_end(user_id)
+            if known == profile:
+                return
+            # Строка уже есть в БД, новое имя можно записать позже
+            self._pending[user_id] = profile
+            self._remember(user_id, profile)
+            if len(self._pending) >= USER_FLUSH_BATCH:
+                self._wake.set()
+            return
+
+        await self.db.get_or_create_user(user_id, username, first_name)
+        self._remember(user_id, profile)
+
+    def _remember(self, user_id: int, profile: Profile):
+        self._seen[user_id] = profile
+        self._seen.move_to_end(user_id)
+        while len(self._seen) > self.capacity:
+            self._seen.popitem(last=False)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await self.db.upsert_users([(uid, username, first_name) for uid, (username, first_name) in batch.items()])
+        except Exception as e:
+            logger.error(f"Не удалось записать {len(batch)} пользователей: {e}")
+            # Возвращаем в очередь, не затирая более свежие изменения
+            for uid, profile in batch.items():
+                self._pending.setdefault(uid, profile)
+            raise
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=USER_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                await asyncio.sleep(USER_FLUSH_INTERVAL)
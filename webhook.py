@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+from typing import List, Optional
+
+from aiohttp import ClientSession, web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip()  # публичный адрес; пусто — setWebhook не вызываем
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """SimpleRequestHandler aiogram, который кладёт обновление в ограниченную очередь.
+
+    Проверку секрета и регистрацию маршрута берём у aiogram. Фоновый режим
+    aiogram создаёт по задаче на каждое обновление без ограничения числа;
+    здесь обновление ставится в очередь, а переполненная очередь даёт 503,
+    чтобы Telegram повторил доставку позже.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, queue: asyncio.Queue, secret_token: Optional[str]):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token)
+        self.queue = queue
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        try:
+            update = await request.json(loads=bot.session.json_loads)
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(update, dict):
+            # Обновление Telegram — всегда JSON-объект
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning("Очередь обновлений переполнена, отвечаем 503")
+            return web.Response(status=503)
+        return web.Response()
+
+    async def close(self) -> None:
+        # Сессия бота нужна, чтобы дообработать очередь после остановки HTTP-сервера
+        pass
+
+
+class WebhookServer:
+    """Принимает обновления от Telegram по HTTP и обрабатывает их в фоне.
+
+    Ответ 200 отдаётся сразу после постановки обновления в очередь,
+    обработку ведут WEBHOOK_WORKERS фоновых задач.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int = WEBHOOK_WORKERS,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE, secret: str = WEBHOOK_SECRET):
+        self.dp = dp
+        self.bot = bot
+        self.workers = workers
+        self.secret = secret
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.app = web.Application()
+        QueuedRequestHandler(dp, bot, self.queue, secret or None).register(self.app, path=WEBHOOK_PATH)
+        self.app.router.add_get("/healthz", self.handle_health)
+        metrics.add_routes(self.app)
+        self._runner: Optional[web.AppRunner] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "ok",
+            "queue": self.queue.qsize(),
+            "workers": self.workers,
+        })
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+            except Exception as e:
+                logger.exception(f"Ошибка обработки обновления {update.get('update_id')}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logger.info(f"Webhook-сервер слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, обработчиков: {self.workers}")
+
+        if WEBHOOK_URL:
+            await self.bot.set_webhook(
+                WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=self.secret or None,
+                allowed_updates=self.dp.resolve_used_update_types(),
+                max_connections=min(max(self.workers, 1), 100),
+            )
+            logger.info(f"Webhook зарегистрирован: {WEBHOOK_URL}")
+
+    async def stop(self, drain_timeout: float = 10):
+        if self._runner:
+            await self._runner.cleanup()
+        # Дообрабатываем то, что уже приняли от Telegram
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не обработано обновлений при остановке: {self.queue.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        # Без секрета любой, кто знает адрес, может прислать поддельное обновление от имени админа
+        raise ValueError("WEBHOOK_URL задан без WEBHOOK_SECRET: публичный webhook должен проверять секрет")
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET не задан: обновления принимаются без проверки отправителя")
+    server = WebhookServer(dp, bot)
+    await dp.emit_startup(bot=bot)
+    try:
+        await server.start()
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+        await dp.emit_shutdown(bot=bot)
+
+
+async def _post_updates(path: str, url: str):
+    """Отправляет записанные обновления (JSON-объект или список) на локальный сервер."""
+    with open(path, encoding="utf-8") as f:
+        updates = json.load(f)
+    if isinstance(updates, dict):
+        updates = [updates]
+    headers = {SECRET_HEADER: WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+    async with ClientSession() as session:
+        for update in updates:
+            async with session.post(url, json=update, headers=headers) as response:
+                print(f"update {update.get('update_id')}: HTTP {response.status}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Использование: python webhook.py updates.json [http://localhost:{WEBHOOK_PORT}{WEBHOOK_PATH}]")
+        sys.exit(1)
+    target = sys.argv[2] if len(sys.argv) > 2 else f"http://localhost:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+    asyncio.run(_post_updates(sys.argv[1], target))